@@ -0,0 +1,132 @@
+""" ADIF output generator and reader
+This is a generic ADIF (Amateur Data Interchange Format) generator which can
+be used to export the parsed logs into other logging applications.
+The records are generated one by one, so they can be streamed to the output.
+The reader parses the records of ADIF files (e.g. exported confirmations)
+in the same streaming way.
+"""
+
+import re
+import datetime
+
+import bandplan
+
+adif_version = "3.1.0"
+program_id = "SOTAnaplo"
+
+# modes understood by the log parser which are valid ADIF modes
+adif_mode = {
+    "CW": "CW",
+    "SSB": "SSB",
+    "FM": "FM",
+    "AM": "AM",
+}
+
+# data specifier of a field: <name:length[:type]>, or a tag without data
+field_tag = re.compile(r"<([A-Za-z0-9_]+)(?::([0-9]+)(?::[A-Za-z])?)?>")
+read_size = 1 << 16
+
+# qsl annotations of the log: @ - bureau, % or $ - direct
+adif_qsl_via = {
+    "@": "B",
+    "%": "D",
+    "$": "D",
+}
+
+
+def field(name, value):
+    """ Format a single ADIF field, the value is converted to string
+    """
+    value = str(value)
+    return "<{}:{}>{}".format(name, len(value), value)
+
+
+def header():
+    """ Return the ADIF file header
+    """
+    return "ADIF export from {}\n{} {}\n<EOH>\n".format(
+        program_id,
+        field("ADIF_VER", adif_version),
+        field("PROGRAMID", program_id))
+
+
+def record(fields):
+    """ Build an ADIF record from a list of (name, value) pairs
+    Empty values are skipped
+    """
+    return " ".join(field(k, v) for k,v in fields if v) + " <EOR>"
+
+
+def qso_record(qso, qso_date, station_callsign, my_sota_ref=None):
+    """ Build the ADIF record of a parsed qso
+    The qso date is given separately, as the qsos contain only the time
+    """
+    freq = bandplan.lookup(qso.freq)
+    fields = [
+        ("CALL", qso.callsign),
+        ("QSO_DATE", qso_date.strftime("%Y%m%d")),
+        ("TIME_ON", "{:02}{:02}".format(qso.time[0], qso.time[1])),
+        ("BAND", freq[2][2] if freq else None),
+        # band names have no exact frequency
+        ("FREQ", qso.freq[:-3] if qso.freq.endswith("MHz") else None),
+        ("MODE", adif_mode.get(qso.mode)),
+        ("RST_SENT", qso.sent),
+        ("RST_RCVD", qso.rcvd),
+        ("SRX_STRING", getattr(qso, "exch", None)),
+        ("STATION_CALLSIGN", station_callsign),
+        ("MY_SOTA_REF", my_sota_ref),
+        ("SOTA_REF", getattr(qso, "ref", None)),
+    ]
+    sent = adif_qsl_via.get(getattr(qso, "qsl_sent", None))
+    if sent:
+        fields += [("QSL_SENT", "Y"), ("QSL_SENT_VIA", sent)]
+    rcvd = adif_qsl_via.get(getattr(qso, "qsl_rcvd", None))
+    if rcvd:
+        fields += [("QSL_RCVD", "Y"), ("QSL_RCVD_VIA", rcvd)]
+    fields.append(("COMMENT", qso.notes))
+    return record(fields)
+
+
+def read_records(handle):
+    """ Read the records of an ADIF file one by one
+    Each record is returned as a dict of the field names (upper case) and
+    values. The header fields are skipped.
+    The file is read in blocks, so large files are not kept in memory
+    """
+    buffer = ''
+    pos = 0
+    record = {}
+    eof = False
+    while True:
+        m = field_tag.search(buffer, pos)
+        end = m.end() + int(m.group(2) or 0) if m else 0
+        if not m or end > len(buffer):
+            if eof:
+                break
+            block = handle.read(read_size)
+            eof = not block
+            # keep only the part of the buffer which is not parsed yet
+            buffer = buffer[pos:] + block
+            pos = 0
+            continue
+        name = m.group(1).upper()
+        pos = end
+        if name == 'EOH':
+            record = {}
+        elif name == 'EOR':
+            yield record
+            record = {}
+        elif m.group(2):
+            record[name] = buffer[m.end():end]
+
+
+def record_date(record):
+    """ Return the qso date of a record, None if missing or invalid
+    """
+    date = record.get('QSO_DATE', '')
+    if len(date) != 8 or not date.isdigit():
+        return None
+    try:
+        return datetime.date(int(date[:4]), int(date[4:6]), int(date[6:]))
+    except ValueError:
+        return None
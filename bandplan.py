@@ -0,0 +1,93 @@
+""" Amateur radio band plan shared by the log converter and the Cabrillo
+generator.
+Every band is described by its lower and upper edge in MHz, the band name used
+in the SOTA/ADIF logs and the band label used in Cabrillo files (None if the
+band is not used in contests).
+The bands are kept sorted by frequency so the band of a frequency is found
+with a binary search.
+"""
+
+import re
+import bisect
+import functools
+
+
+bands = [
+    ( 1.8, 2.0, '160m', '160M' ),
+    ( 3.5, 4.0, '80m', '80M' ),
+    ( 7.0, 7.3, '40m', '40M' ),
+    ( 10.1, 10.15, '30m', None ),
+    ( 14.0, 14.35, '20m', '20M' ),
+    ( 18.068, 18.168, '17m', None ),
+    ( 21.0, 21.45, '15m', '15M' ),
+    ( 24.89, 24.99, '12m', None ),
+    ( 28.0, 29.7, '10m', '10M' ),
+    ( 50.0, 54.0, '6m', '6M' ),
+    ( 70.0, 70.5, '4m', '4M' ),
+    ( 144.0, 148.0, '2m', '2M' ),
+    ( 219.0, 225.0, '1.25m', '222' ),
+    ( 420.0, 450.0, '70cm', '432' ),
+    ( 902.0, 928.0, '35cm', '902' ),
+    ( 1240.0, 1300.0, '23cm', '1.2G' ),
+    ( 2300.0, 2450.0, '13cm', '2.3G' ),
+    ( 3400.0, 3475.0, '9cm', '3.4G' ),
+    ( 5650.0, 5850.0, '6cm', '5.7G' ),
+    ( 10000.0, 10500.0, '3cm', '10G' ),
+    ( 24000.0, 24250.0, '1.25cm', '24G' ),
+    ( 47000.0, 47200.0, '6mm', '47G' ),
+    ( 75500.0, 81500.0, '4mm', '75G' ),
+    ( 122250.0, 123000.0, '2.5mm', '119G' ),
+    ( 134000.0, 141000.0, '2mm', '142G' ),
+    ( 241000.0, 250000.0, '1mm', '241G' ),
+]
+
+# index structures for the lookups
+lower_edges = [b[0] for b in bands]
+band_names = {b[2]: b for b in bands}
+band_labels = {b[3]: b for b in bands if b[3]}
+
+freq = re.compile(r"((?:[0-9]+\.)?[0-9]+)([kMG]?Hz|[mc]?m)?")
+freq_units = {
+    'Hz': 0.000001,
+    'kHz': 0.001,
+    'MHz': 1.0,
+    'GHz': 1000.0,
+}
+
+
+def find_band(mhz):
+    """ Return the band containing the given frequency (in MHz)
+    or None if the frequency is outside of the amateur bands
+    """
+    i = bisect.bisect_right(lower_edges, mhz) - 1
+    if i >= 0 and mhz <= bands[i][1]:
+        return bands[i]
+    return None
+
+
+@functools.lru_cache(maxsize=1024)
+def lookup(s):
+    """ Normalize a frequency or band string
+    The string can either be a band name (with the m unit as the consacrated
+    bands) or a frequency with an optional unit (MHz if missing)
+    Return a tuple of the normalized string, the frequency in MHz and the band
+    or None if the string is not a valid amateur band frequency.
+    For band names the frequency is the lower edge of the band.
+    """
+    m = freq.fullmatch(s)
+    if not m:
+        return None
+    unit = m.group(2)
+    if unit and unit.endswith('m'):
+        band = band_names.get(s)
+        if band is None:
+            return None
+        return s, band[0], band
+
+    mhz = float(m.group(1)) * freq_units[unit or 'MHz']
+    band = find_band(mhz)
+    if band is None:
+        return None
+    if unit is None or unit == 'MHz':
+        return m.group(1) + 'MHz', mhz, band
+    return "{:.3f}MHz".format(mhz), mhz, band
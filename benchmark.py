@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+""" Benchmarks for the log processing code paths
+The benchmarks run on synthetic data generated with a fixed seed, so the
+results of different versions of the code can be compared.
+"""
+
+import time
+import random
+import datetime
+import argparse
+import tracemalloc
+import os
+import io
+
+import log2csv
+import cabrillo
+
+
+bench_calls = ['DL1ABC', 'G4XYZ', 'YO9AAA/P', 'W1AW', 'HA5AAA/P', 'K1ZZ',
+               'M0ABC', 'YO6PIB/P', 'DL/G4XYZ/P', '2E0AAA', 'GM4ABC', 'OE5ABC']
+bench_freqs = ['14.062', '7.030', '145.500', '10.118', '3.7', '14062kHz']
+bench_modes = ['cw', 'ssb', 'fm', 'ft8']
+
+
+def generate_lines(count, seed=1):
+    """ Generate qso lines similar to a real log: time increasing, few
+    distinct chasers and mostly the same frequency and mode
+    """
+    rnd = random.Random(seed)
+    lines = []
+    minute = 0
+    for i in range(count):
+        minute = (minute + rnd.randint(0, 2)) % 60
+        w = ['{}'.format(minute)]
+        w.append(rnd.choice(bench_calls))
+        if rnd.random() < 0.1:
+            w.append(rnd.choice(bench_freqs))
+            w.append(rnd.choice(bench_modes[:2]))
+        if rnd.random() < 0.3:
+            w.extend(['559', '579'] if 'cw' in w else ['55', '57'])
+        if rnd.random() < 0.1:
+            w.append('@')
+        lines.append(' '.join(w))
+    return ['0800 YO6PIB 14.062 cw'] + lines
+
+
+def bench_parse(args):
+    lines = generate_lines(args.count)
+    best = None
+    for r in range(args.repeat):
+        start = time.perf_counter()
+        prev = None
+        for line in lines:
+            try:
+                prev = log2csv.QSO(line, prev)
+            except log2csv.LogException:
+                pass
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print('parse: {} lines, {:.3f} s, {:.2f} us/line'.format(
+        len(lines), best, best / len(lines) * 1e6))
+
+
+def bench_memory(args):
+    lines = generate_lines(args.count)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    qsos = []
+    prev = None
+    for line in lines:
+        try:
+            prev = log2csv.QSO(line, prev)
+            qsos.append(prev)
+        except log2csv.LogException:
+            pass
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    print('memory: {} qsos, {:.1f} MiB, {:.1f} bytes/qso'.format(
+        len(qsos), used / 2**20, used / len(qsos)))
+
+
+def bench_output(args):
+    lines = generate_lines(args.count)
+    activation = log2csv.Activation('YO6PIB 2019-05-04 YO/EC-001')
+    for line in lines:
+        try:
+            activation.add_qso(line)
+        except log2csv.LogException:
+            pass
+    best = None
+    for r in range(args.repeat):
+        handle = open(os.devnull, 'w')
+        start = time.perf_counter()
+        activation.print_qsos(handle=handle)
+        handle.close()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print('output: {} qsos, {:.3f} s, {:.2f} us/qso'.format(
+        len(activation.qsos), best, best / len(activation.qsos) * 1e6))
+
+
+def bench_cabrillo(args):
+    rnd = random.Random(1)
+    log = cabrillo.Cabrillo({'callsign': 'YO6PIB', 'contest': 'FIELD-DAY'})
+    day = datetime.date(2019, 6, 22)
+    for i in range(args.count):
+        log.add_qso(rnd.choice(['14.062MHz', '7.030MHz', '3.560MHz']), 'CW', day,
+                    ((i // 60) % 24, i % 60), 'YO6PIB', '599', '{:03}'.format(i % 1000),
+                    rnd.choice(bench_calls), '599', '{:03}'.format(rnd.randint(1, 999)),
+                    0, 2, 1)
+    text = str(log)
+    best = None
+    for r in range(args.repeat):
+        start = time.perf_counter()
+        fields, qsos = cabrillo.read(io.StringIO(text))
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print('cabrillo: {} qsos, {:.1f} MB, {:.3f} s, {:.0f} qsos/s, {:.1f} MB/s'.format(
+        len(qsos), len(text) / 1e6, best, len(qsos) / best, len(text) / 1e6 / best))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for SOTAnaplo')
+    parser.add_argument('-n', '--count', type=int, default=100000,
+                        help='Number of generated records')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of repetitions, the best time is reported')
+    parser.add_argument('bench', choices=['parse', 'memory', 'output', 'cabrillo'],
+                        help='Benchmark to run')
+    args = parser.parse_args()
+
+    globals()['bench_' + args.bench](args)
@@ -3,10 +3,20 @@ This is a generic cabrillo format generator which can be used by the contest
 builder to create an output
 """
 
-cbr_file = """START-OF-LOG: 3.0
-{fields}
-{qsos}
-END-OF-LOG:"""
+import io
+import shutil
+import tempfile
+import datetime
+import functools
+
+import bandplan
+
+cbr_start = "START-OF-LOG: 3.0"
+cbr_end = "END-OF-LOG:"
+
+# formatted qsos are kept in memory up to this size, then spilled to a
+# temporary file
+spool_size = 1 << 20
 
 contests = [
     "AP-SPRINT",
@@ -73,32 +83,6 @@ stations = [
     "SCHOOL",
 ]
 
-bands = {
-    '160M'   : ( 1.8, 2.0 ),
-    '80M'    : ( 3.5, 4.0 ),
-    '40M'    : ( 7.0, 7.3 ),
-    '20M'    : ( 14.0, 14.35 ),
-    '15M'    : ( 21.0, 21.45 ),
-    '10M'    : ( 28.0, 29.7 ),
-    '6M'     : ( 50.0, 54.0 ),
-    '4M'     : ( 70.0, 70.5),
-    '2M'     : ( 144.0, 148.0 ),
-    '222'    : ( 219.0, 225.0 ),
-    '432'    : ( 420.0, 450.0 ),
-    '902'    : ( 902.0, 928.0 ),
-    '1.2G'   : ( 1240.0, 1300.0 ),
-    '2.3G'   : ( 2300.0, 2450.0 ),
-    '3.4G'    : ( 3400.0, 3475.0 ),
-    '5.7G'    : ( 5650.0, 5850.0 ),
-    '10G'    : ( 10000.0, 10500.0 ),
-    '24G' : ( 24000.0, 24250.0 ),
-    '47G'    : ( 47000.0, 47200.0 ),
-    '75G'    : ( 75500.0, 81500.0 ),
-    '119G'  : ( 122250.0, 123000.0 ),
-    '142G'    : ( 134000.0, 141000.0 ),
-    '241G'    : ( 241000.0, 250000.0 ),
-}
-
 # order in which different fields are printed to the output
 field_list = [
     "callsign",
@@ -208,34 +192,26 @@ def clean_freq(f):
     """ return the frequency and the corresponding band cleaned upper
     for cabrillo format
     """
-    if f.endswith('MHz'):
-        freq = float(f[:-3])
-    elif f.endswith('kHz'):
-        freq = float(f[:-3]) / 1000
-    elif f.endswith('GHz'):
-        freq = float(f[:-3]) * 1000
-    else:
-        freq = float(f)
+    m = bandplan.lookup(f)
+    if not m or not m[2][3]:
+        raise ValueError("Frequency {} is not in a contest band".format(f))
+    _, freq, band = m
 
     if freq < 30:
         nfreq = round(freq * 1000)
     elif freq < 1000:
         nfreq = round(freq)
-    elif freq < 10000:
-        nfreq = "{:.1}G".format(freq / 1000)
     else:
-        nfreq = "{}G".format(round(freq / 1000))
-
-    for k,v in bands.items():
-        if freq >= v[0] and freq <= v[1]:
-            band = k
-            break
+        nfreq = band[3]
 
-    return nfreq, band
+    return nfreq, band[3]
 
 class Cabrillo:
     """ This is an object containing all the information needed for the
     Cabrillo header and the QSOs
+    The header values (score, band, mode) are kept as running totals, while
+    the formatted QSO lines are spooled into a temporary file, so the log
+    can be streamed to the output after all QSOs are added
     """
     def __init__(self, config=None):
         """ Initialize the generator object with an optional config
@@ -245,7 +221,10 @@ class Cabrillo:
 
         self.score = 0
         self.mult = 0
-        self.qsos = []
+        self.qsos = tempfile.SpooledTemporaryFile(spool_size, 'w+', encoding='utf-8')
+        self.qso_count = 0
+        # line numbers of the removed qsos, skipped when writing
+        self.removed = set()
         self.fields = dict(field_default)
 
         # qso information by majority vote
@@ -341,7 +320,7 @@ class Cabrillo:
 
     def add_qso(self, freq, mode, date, time, call_sent, rst_sent, exch_sent, call_rcvd, rst_rcvd, exch_rcvd, t, score, mult):
         nfreq, band = clean_freq(freq)
-        self.qsos.append(cbr_qso.format(
+        self.qsos.write(cbr_qso.format(
                 f = nfreq,
                 m = cbr_mode.get(mode.upper(), mode),
                 d = date.strftime("%Y-%m-%d"),
@@ -354,6 +333,8 @@ class Cabrillo:
                 re = exch_rcvd,
                 t = t
             ))
+        self.qsos.write('\n')
+        self.qso_count += 1
         self.score += score
         self.mult = mult
 
@@ -368,6 +349,17 @@ class Cabrillo:
             self.band = 0
 
 
+    def remove_qso(self, index, score, mult):
+        """ Remove the qso with the given line number (counted from 0 in the
+        order the qsos were added) and take back its score
+        The band and mode guessed for the header are not changed
+        """
+        self.removed.add(index)
+        self.qso_count -= 1
+        self.score -= score
+        self.mult = mult
+
+
     def fields_str(self):
         for i in range(len(field_list)):
             field = field_list[i]
@@ -384,8 +376,159 @@ class Cabrillo:
                 yield "{}: {}".format(field_names['mode'], field_values['mode'][self.mode])
 
 
+    def write(self, handle):
+        """ Write the complete log into the handle, the header is generated
+        from the running totals and the QSO lines are copied from the spool
+        """
+        handle.write(cbr_start + '\n')
+        for line in self.fields_str():
+            handle.write(line.format(score=self.score * self.mult) + '\n')
+        self.qsos.seek(0)
+        if self.removed:
+            for i, line in enumerate(self.qsos):
+                if i not in self.removed:
+                    handle.write(line)
+        else:
+            shutil.copyfileobj(self.qsos, handle)
+        self.qsos.seek(0, io.SEEK_END)
+        handle.write(cbr_end + '\n')
+
+
+    def close(self):
+        """ Release the spooled QSO lines
+        """
+        self.qsos.close()
+
+
     def __str__(self):
-        return cbr_file.format(
-            fields = "\n".join(self.fields_str()).format(score=self.score * self.mult),
-            qsos = "\n".join(self.qsos)
-        )
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()[:-1]
+
+
+# cabrillo tags of the header fields
+field_tags = {v: k for k,v in field_names.items()}
+
+# modes of the qso lines translated back to the log modes
+log_mode = {
+    "PH": "SSB",
+    "CW": "CW",
+    "FM": "FM",
+    "RY": "Data",
+    "DG": "Data",
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_freq(f):
+    """ Convert the frequency of a cabrillo qso line into the frequency
+    format of the log (MHz or band name)
+    HF frequencies are given in kHz, above 30MHz the band is given
+    """
+    if f in bandplan.band_labels:
+        # microwave bands have no frequency only the band label
+        return bandplan.band_labels[f][2]
+    freq = float(f)
+    if freq >= 1000:
+        return "{:.3f}MHz".format(freq / 1000)
+    return "{}MHz".format(f)
+
+
+class CabrilloQSO:
+    """ A qso read from a cabrillo log
+    It has the same fields as the qsos parsed from the simplified log
+    (time, callsign, freq, mode, sent, rcvd, exch, notes, day) so it can be
+    used by the contest scoring and the output generators, in addition to
+    the date and the sent part of the exchange
+    """
+    __slots__ = ('time', 'callsign', 'freq', 'mode', 'sent', 'rcvd', 'exch',
+                 'notes', 'day', 'date', 'call_sent', 'exch_sent', 'transmitter')
+
+
+def parse_qso(words):
+    """ Parse the words of a QSO: line (without the QSO: tag) into a qso
+    The columns are freq mode date time and then the sent and the received
+    exchange with the same number of columns, each starting with the call
+    and the rst (if present in the log), followed by an optional transmitter
+    number
+    """
+    if len(words) < 6:
+        raise ValueError("Invalid QSO line")
+    qso = CabrilloQSO()
+    qso.freq = parse_freq(words[0])
+    qso.mode = log_mode.get(words[1], words[1])
+    qso.date = datetime.date.fromisoformat(words[2])
+    t = int(words[3])
+    qso.time = (t // 100, t % 100)
+    rest = words[4:]
+    if len(rest) % 2:
+        qso.transmitter = rest.pop()
+    else:
+        qso.transmitter = None
+    half = len(rest) // 2
+    sent = rest[:half]
+    rcvd = rest[half:]
+    qso.call_sent = sent[0]
+    qso.callsign = rcvd[0]
+    if half > 2:
+        qso.sent = sent[1]
+        qso.rcvd = rcvd[1]
+        qso.exch_sent = ' '.join(sent[2:])
+        qso.exch = ' '.join(rcvd[2:])
+    else:
+        qso.sent = qso.rcvd = None
+        qso.exch_sent = ' '.join(sent[1:])
+        qso.exch = ' '.join(rcvd[1:])
+    qso.notes = ''
+    qso.day = 0
+    return qso
+
+
+class Reader:
+    """ Streaming reader of cabrillo logs
+    Iterating the reader returns the qsos of the log one by one, while the
+    header is parsed into the fields dictionary (using the same keys as the
+    field_names) as the header lines are read. Tags which are not known are
+    kept in the extra dictionary.
+    """
+    def __init__(self, handle):
+        self.handle = handle
+        self.fields = {}
+        self.extra = {}
+        self.line = 0
+
+
+    def __iter__(self):
+        for line in self.handle:
+            self.line += 1
+            if line.startswith('QSO:'):
+                try:
+                    yield parse_qso(line[4:].split())
+                except (ValueError, IndexError):
+                    raise ValueError("Invalid QSO in line {}".format(self.line))
+                continue
+            tag, sep, value = line.partition(':')
+            if not sep:
+                continue
+            tag = tag.strip().upper()
+            value = value.strip()
+            if tag == 'END-OF-LOG':
+                break
+            if tag in ('START-OF-LOG', 'X-QSO'):
+                continue
+            key = field_tags.get(tag)
+            if key in mergeable_fields:
+                self.fields[key] = merge_field(self.fields.get(key), value)
+            elif key:
+                self.fields[key] = value
+            else:
+                self.extra[tag] = merge_field(self.extra.get(tag), value)
+
+
+def read(handle):
+    """ Read a complete cabrillo log
+    Return the header fields and the list of qsos
+    """
+    reader = Reader(handle)
+    qsos = list(reader)
+    return reader.fields, qsos
@@ -1,19 +1,225 @@
 """ This module handles contesting rules if used during the activation
-Rules will be specified in separate files and the Contest class implemented
+Rules are specified in separate files and the Contest class implemented
 in this module will build the corresponding contest object based on
 parameters specified in the activation declaration.
 
-TODO: right now a field day contest is hardcoded, it should be externalized
-from this file
+A rule file `<name>.rules` is looked up in the current directory and in the
+contests directory next to this module. It contains `key: value` lines:
+  name: the contest name used in the cabrillo output
+  exchange: regular expression of the received exchange
+  sent: format of the sent exchange, {serial} is the qso serial number
+  missing: exchange logged if the received one is missing
+  points: N [if condition [and condition...]], can be given multiple
+      times, the first matching rule gives the points of the qso
+  multiply: N if condition [and condition...], multiplies the points
+  mult: multiplier keys, the multiplier is the number of distinct keys
+The rule file is compiled into python functions, the compiled code is
+cached next to the rule file.
 """
 
+import os
 import re
+import marshal
+import tempfile
+import importlib.util
+
 import cabrillo
 import country
 
 
 prefix = re.compile(r"(?:(?=.?[a-z])[0-9a-z]{1,2}(?:(?<=3d)a)?)")
 
+# directories searched for rule files
+rules_path = ['.', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'contests')]
+rules_ext = '.rules'
+compiled_ext = '.rulesc'
+# version of the rule translator, change it whenever translate_rules
+# generates different code, so the cached compiled rules are rebuilt
+translator_version = 1
+
+# conditions usable in the point rules, as python expressions of the
+# scoring function arguments
+rule_conditions = {
+    'portable': "callsign.endswith(('/P', '/M'))",
+    'fixed': "not callsign.endswith(('/P', '/M'))",
+    'same-country': "cty == own[0]",
+    'other-country': "cty != own[0]",
+    'same-continent': "info['continent'] == own[1]['continent']",
+    'other-continent': "info['continent'] != own[1]['continent']",
+    'cw': "mode == 'CW'",
+    'phone': "mode == 'PH'",
+    'fm': "mode == 'FM'",
+    'digital': "mode in ('RY', 'DG')",
+}
+
+# keys usable for the multipliers
+rule_mult_keys = {
+    'band': "band",
+    'mode': "mode",
+    'call': "callsign",
+    'country': "cty",
+    'continent': "info['continent']",
+    'cq': "info['cq']",
+    'itu': "info['itu']",
+}
+
+# loaded rules by contest name
+loaded_rules = {}
+
+
+def find_rules(name):
+    """ Return the path of the rule file of the contest or None
+    """
+    if not re.fullmatch(r"\w+", name):
+        return None
+    for directory in rules_path:
+        filename = os.path.join(directory, name + rules_ext)
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def rule_condition(conditions, line):
+    """ Translate the conditions of a rule into a python expression
+    """
+    expr = []
+    for c in conditions.split(' and '):
+        c = c.strip()
+        if c not in rule_conditions:
+            raise ValueError("Unknown rule condition `{}` in line {}".format(c, line))
+        expr.append(rule_conditions[c])
+    return ' and '.join(expr)
+
+
+def rule_value(value, line):
+    """ Split a rule value into the number and the python condition
+    """
+    number, _, conditions = value.partition(' if ')
+    try:
+        number = int(number)
+    except ValueError:
+        raise ValueError("Invalid number of points in line {}".format(line))
+    return number, rule_condition(conditions, line) if conditions else None
+
+
+def translate_rules(filename):
+    """ Translate a rule file into python source code defining the contest
+    constants and the scoring functions
+    """
+    rules = {'sent': '{serial:03}', 'missing': ''}
+    points = []
+    multiply = []
+    mult = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        i = 0
+        for line in f:
+            i += 1
+            line = line.partition('#')[0].strip()
+            if not line:
+                continue
+            code = [x.strip() for x in line.split(':', 1)]
+            if len(code) != 2 or not code[0] or not code[1]:
+                raise ValueError("Invalid rule line {}".format(i))
+            if code[0] in ('name', 'exchange', 'sent', 'missing'):
+                rules[code[0]] = code[1]
+            elif code[0] == 'points':
+                points.append(rule_value(code[1], i))
+            elif code[0] == 'multiply':
+                multiply.append(rule_value(code[1], i))
+                if multiply[-1][1] is None:
+                    raise ValueError("Missing condition in line {}".format(i))
+            elif code[0] == 'mult':
+                for k in code[1].split():
+                    if k not in rule_mult_keys:
+                        raise ValueError("Unknown multiplier key `{}` in line {}".format(k, i))
+                    mult.append(rule_mult_keys[k])
+            else:
+                raise ValueError('Invalid rule `{}` in line {}'.format(code[0], i))
+
+    for k in ('name', 'exchange'):
+        if k not in rules:
+            raise ValueError("Missing `{}` rule".format(k))
+    re.compile(rules['exchange'])
+
+    source = ["{} = {!r}".format(k, v) for k,v in sorted(rules.items())]
+    source.append("def score(callsign, mode, band, cty, info, own):")
+    source.append("    points = 0")
+    keyword = "if"
+    for number, condition in points:
+        if condition:
+            source.append("    {} {}:".format(keyword, condition))
+            source.append("        points = {}".format(number))
+            keyword = "elif"
+        else:
+            source.append("    {}:".format("else" if keyword == "elif" else "if True"))
+            source.append("        points = {}".format(number))
+            break
+    for number, condition in multiply:
+        source.append("    if {}:".format(condition))
+        source.append("        points *= {}".format(number))
+    source.append("    return points")
+    source.append("def mult_key(callsign, mode, band, cty, info):")
+    source.append("    return ({},)".format(', '.join(mult)) if mult else "    return None")
+    return '\n'.join(source) + '\n'
+
+
+def compile_rules(filename):
+    """ Compile the rule file into a code object
+    The compiled code is cached next to the rule file and reused while the
+    rule file is not changed
+    """
+    st = os.stat(filename)
+    key = (importlib.util.MAGIC_NUMBER, translator_version, st.st_size, st.st_mtime_ns)
+    cache = os.path.splitext(filename)[0] + compiled_ext
+    try:
+        with open(cache, 'rb') as f:
+            cached_key, code = marshal.load(f)
+        if cached_key == key:
+            return code
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    code = compile(translate_rules(filename), filename, 'exec')
+    try:
+        # write a temporary file unique to this process and replace the
+        # cache with it, so other processes never read a partially written
+        # cache
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((key, code), f)
+            os.replace(tmp, cache)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    except OSError:
+        # the cache is only an optimization
+        pass
+    return code
+
+
+def load_rules(name):
+    """ Return the rules of the contest as a dict with the constants and
+    functions defined by the rule file
+    If no rule file is found for that name then an exception is thrown
+    """
+    if name not in loaded_rules:
+        filename = find_rules(name)
+        if not filename:
+            raise ValueError("Undefined contest")
+        rules = {}
+        exec(compile_rules(filename), rules)
+        loaded_rules[name] = rules
+    return loaded_rules[name]
+
+
+def qso_key(callsign, freq, mode):
+    """ Return the key identifying a contact with a station:
+    the callsign, the cabrillo band and the cabrillo mode
+    """
+    _, band = cabrillo.clean_freq(freq)
+    mode = mode.upper()
+    return callsign.upper(), band, cabrillo.cbr_mode.get(mode, mode)
+
 
 class Contest:
     """ Contest object allows to create a contest handling engine to be used
@@ -30,38 +236,83 @@ class Contest:
         If no contest is found for that name then an exception is thrown
         """
 
-        # TODO: currently hardcoded for Field-Day
-        if name != "fd":
-            raise ValueError("Undefined contest")
+        self.rules = load_rules(name)
 
         # rule for the received exchange, will be used by the qso parser
-        self.exchange = re.compile(r"[0-9]{3,4}")
+        self.exchange = re.compile(self.rules['exchange'])
 
         # internal representation
         self.output = cabrillo.Cabrillo()
         self.exch = 0
-        # multiplier is the number of countries
-        self.mult = set()
+        # running totals, updated on every added or removed qso
+        self.points = 0
+        # multiplier is the number of distinct multiplier keys,
+        # the keys are counted so removed qsos can be taken back
+        self.mult = {}
+        # band -> [qsos, points, {multiplier key: count}]
+        self.bands = {}
+        # serial number -> [key, callsign, country, points, multiplier key]
+        # points is None for dupes
+        self.qsos = {}
+        # dupe index: (call, band, mode) -> serial number of the first qso
+        self.worked = {}
+        # (call, band, mode) -> serial numbers of the dupes, in order
+        self.dupe_serials = {}
+        self.dupes = 0
+
+
+    def dupe_key(self, callsign, freq, mode):
+        """ Return the key identifying a contact for dupe checking:
+        the callsign, the band and the cabrillo mode
+        """
+        return qso_key(callsign, freq, mode)
+
+
+    def worked_before(self, callsign, freq, mode):
+        """ Return the serial number of the earlier qso with the same station
+        on the same band and mode, or None if this contact is not a dupe
+        Can be used to check dupes while the log is entered
+        """
+        return self.worked.get(self.dupe_key(callsign, freq, mode))
 
 
-    def add_qso(self, call, date, qso):
+    def is_dupe(self, callsign, freq, mode):
+        return self.dupe_key(callsign, freq, mode) in self.worked
+
+
+    def add_qsos(self, call, date, qsos):
+        """ Add all qsos of an activation to the contest list
+        The countries of the contacted callsigns are resolved in one pass
+        """
+        ctys = country.find_many(qso.callsign for qso in qsos)
+        for qso in qsos:
+            self.add_qso(call, date, qso, ctys[qso.callsign])
+
+
+    def add_qso(self, call, date, qso, cty=None):
         """ Add an individual qso line to the contest list
         If the QSO does not contain received exchange and the contest does not
         allow such QSOs then it will be ignored.
         The sent exchange is automatically filled from the contest rules and
         initial parameters
+        The country of the contacted station can be given if already known
+        Dupes (same station on the same band and mode) are logged with zero
+        points
+        Return the serial number of the qso
         """
         self.exch += 1
-        # check call for scoring
-        cty, ctyinfo = country.find(qso.callsign)
-        _,band = cabrillo.clean_freq(qso.freq)
-        self.mult.add((band, cty))
-        if qso.callsign.endswith('/P') or qso.callsign.endswith('/M'):
-            score = 3
+        key = self.dupe_key(qso.callsign, qso.freq, qso.mode)
+        entry = [key, qso.callsign, cty, None, None]
+        self.qsos[self.exch] = entry
+        band = self.bands.setdefault(key[1], [0, 0, {}])
+        band[0] += 1
+        if key in self.worked:
+            self.dupes += 1
+            self.dupe_serials.setdefault(key, {})[self.exch] = None
+            score = 0
         else:
-            score = 2
-        if ctyinfo['continent'] != self.continent:
-            score *= 2
+            self.worked[key] = self.exch
+            score = self.count_qso(entry)
         self.output.add_qso(
             qso.freq,
             qso.mode,
@@ -69,13 +320,102 @@ class Contest:
             qso.time,
             call,
             qso.sent,
-            "{:03}".format(self.exch),
+            self.rules['sent'].format(serial=self.exch),
             qso.callsign,
             qso.rcvd,
-            getattr(qso, 'exch', '000'),
+            getattr(qso, 'exch', self.rules['missing']),
             0,
             score,
-            len(self.mult))
+            len(self.mult) or 1)
+        return self.exch
+
+
+    def count_qso(self, entry):
+        """ Score a qso which is not a dupe and add it to the running totals
+        """
+        key, callsign, cty, _, _ = entry
+        cty, ctyinfo = cty or country.find(callsign)
+        entry[2] = cty, ctyinfo
+        _, band, mode = key
+        points = self.rules['score'](callsign, mode, band, cty, ctyinfo, self.own)
+        mult = self.rules['mult_key'](callsign, mode, band, cty, ctyinfo)
+        entry[3] = points
+        entry[4] = mult
+        self.points += points
+        stats = self.bands[band]
+        stats[1] += points
+        if mult is not None:
+            self.mult[mult] = self.mult.get(mult, 0) + 1
+            stats[2][mult] = stats[2].get(mult, 0) + 1
+        return points
+
+
+    def uncount_qso(self, entry):
+        """ Take back a scored qso from the running totals
+        """
+        key, _, _, points, mult = entry
+        self.points -= points
+        stats = self.bands[key[1]]
+        stats[1] -= points
+        if mult is not None:
+            for counts in (self.mult, stats[2]):
+                counts[mult] -= 1
+                if not counts[mult]:
+                    del counts[mult]
+        return points
+
+
+    def remove_qso(self, serial):
+        """ Remove a qso added earlier, given by its serial number
+        If the removed qso was the first contact with the station, the next
+        dupe (if any) is scored instead
+        The serial numbers of the remaining qsos are not changed
+        """
+        entry = self.qsos.pop(serial, None)
+        if entry is None:
+            raise ValueError("Unknown qso serial number {}".format(serial))
+        key = entry[0]
+        self.bands[key[1]][0] -= 1
+        score = 0
+        if entry[3] is None:
+            self.dupes -= 1
+            del self.dupe_serials[key][serial]
+        else:
+            score = self.uncount_qso(entry)
+            dupes = self.dupe_serials.get(key)
+            if dupes:
+                first = next(iter(dupes))
+                del dupes[first]
+                self.dupes -= 1
+                self.worked[key] = first
+                score -= self.count_qso(self.qsos[first])
+            else:
+                del self.worked[key]
+        if not self.bands[key[1]][0]:
+            del self.bands[key[1]]
+        self.output.remove_qso(serial - 1, score, len(self.mult) or 1)
+
+
+    def score_summary(self):
+        """ Return the current score of the contest
+        The summary is built from the running totals, it does not depend on
+        the number of qsos
+        """
+        mult = len(self.mult) or 1
+        return {
+            'qsos': len(self.qsos),
+            'dupes': self.dupes,
+            'points': self.points,
+            'mult': mult,
+            'score': self.points * mult,
+            'bands': {
+                band: {
+                    'qsos': stats[0],
+                    'points': stats[1],
+                    'mult': len(stats[2]),
+                } for band, stats in self.bands.items()
+            },
+        }
 
 
     def configure(self, activation, config_file=None):
@@ -87,8 +427,7 @@ class Contest:
             self.output.configure_from_file(config_file)
 
         config = {}
-        # contest is automatically configured for Field day
-        config['contest'] = "FIELD-DAY"
+        config['contest'] = self.rules['name']
 
         # get callsign from the activation
         callsign = getattr(activation, 'callsign')
@@ -114,9 +453,14 @@ class Contest:
 
         self.output.configure(config, True)
 
-        # get own continent from callsign
-        _, ctyinfo = country.find(callsign)
-        self.continent = ctyinfo['continent']
+        # get own country and continent from callsign
+        self.own = country.find(callsign)
+
+
+    def write(self, handle):
+        """ Write the log output for the contest into the handle
+        """
+        self.output.write(handle)
 
 
     def __str__(self):
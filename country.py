@@ -1,52 +1,179 @@
 """ This module allows identifying the country/continent of a given callsign
 The country information is loaded from the cty.dat file which should be
 downloaded from http://www.country-files.com/big-cty/
+The file is looked up in the current directory (or at the path given in the
+CTY_DAT environment variable) and loaded on first use.
 """
 
+import os
 import re
+import marshal
+import tempfile
+import functools
+
+# location of the country database, can be changed with set_database()
+database = os.environ.get('CTY_DAT', 'cty.dat')
+# the parsed database is cached next to it in a binary snapshot
+cache_suffix = '.cache'
+cache_version = 1
+# number of callsigns memoized by find()
+find_cache_size = 8192
 
 countries = {}
 fixcalls = {}
-prefixes = []
-country = None
+# prefix tree: every node is a dict keyed by the next character of the
+# prefix, the country code of a complete prefix is stored under the None key
+prefixes = {}
+# key of the currently loaded database, None if nothing is loaded yet
+loaded = None
+
+
+def add_prefix(prefix, code):
+	""" Insert a prefix into the prefix tree
+	If the same prefix is defined multiple times the first definition is kept
+	"""
+	node = prefixes
+	for c in prefix:
+		node = node.setdefault(c, {})
+	node.setdefault(None, code)
+
 
 prefixfilter = re.compile(r'(?:(?P<exact>=)?(?P<prefix>[A-Z0-9/]+)[][(){}<>~A-Z0-9]*)|;')
-with open("cty.dat", 'r') as ctyfile:
-	for line in ctyfile:
-		if country is None:
-			# first line
-			country = [x.strip() for x in line.split(':')]
-			country_code = country[7]
-			countries[country_code] = {'name': country[0],
-			                           'cq': country[1],
-			                           'itu': country[2],
-			                           'continent': country[3]}
-		else:
-			# prefix lines
-			for prefix in prefixfilter.finditer(line):
-				if prefix.group(0) == ';':
-					# end of country data
-					country = None
-					break
-				elif prefix.group('exact'):
-					# exact call
-					fixcalls[prefix.group('prefix')] = country_code
-				else:
-					# normal prefix
-					prefixes.append((prefix.group('prefix'), country_code))
+def parse(filename):
+	""" Parse the cty.dat file into the country tables
+	"""
+	country = None
+	with open(filename, 'r') as ctyfile:
+		for line in ctyfile:
+			if country is None:
+				# first line
+				country = [x.strip() for x in line.split(':')]
+				country_code = country[7]
+				countries[country_code] = {'name': country[0],
+				                           'cq': country[1],
+				                           'itu': country[2],
+				                           'continent': country[3]}
+			else:
+				# prefix lines
+				for prefix in prefixfilter.finditer(line):
+					if prefix.group(0) == ';':
+						# end of country data
+						country = None
+						break
+					elif prefix.group('exact'):
+						# exact call
+						fixcalls[prefix.group('prefix')] = country_code
+					else:
+						# normal prefix
+						add_prefix(prefix.group('prefix'), country_code)
+
+
+def database_key(filename):
+	""" Return the key identifying the current content of the database file
+	"""
+	st = os.stat(filename)
+	return (cache_version, os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+
+
+def load(filename=None):
+	""" Load the country database from the given file (or the configured one)
+	A binary snapshot of the parsed tables is kept next to the file and used
+	as long as the path, size and modification time of the file match
+	"""
+	global loaded
+	if filename is None:
+		filename = database
+	key = database_key(filename)
+	if key == loaded:
+		return
 
+	countries.clear()
+	fixcalls.clear()
+	prefixes.clear()
+	cache = filename + cache_suffix
+	try:
+		with open(cache, 'rb') as f:
+			data = marshal.load(f)
+		if data[0] != key:
+			raise ValueError('Outdated country cache')
+		countries.update(data[1])
+		fixcalls.update(data[2])
+		prefixes.update(data[3])
+	except (OSError, EOFError, ValueError, TypeError, IndexError):
+		countries.clear()
+		fixcalls.clear()
+		prefixes.clear()
+		parse(filename)
+		try:
+			# replace the cache atomically through a temporary file unique to
+			# this process, other processes may read or write it meanwhile
+			fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache)))
+			try:
+				with os.fdopen(fd, 'wb') as f:
+					marshal.dump((key, countries, fixcalls, prefixes), f)
+				os.replace(tmp, cache)
+			except BaseException:
+				os.remove(tmp)
+				raise
+		except OSError:
+			# the cache is only an optimization
+			pass
+	loaded = key
+	find.cache_clear()
 
+
+def set_database(filename):
+	""" Use the given cty.dat file instead of the one in the current directory
+	The file is loaded only when the first lookup is done
+	"""
+	global database, loaded
+	database = filename
+	loaded = None
+	find.cache_clear()
+
+
+def ensure_loaded():
+	if loaded is None:
+		load()
+
+
+@functools.lru_cache(maxsize=find_cache_size)
 def find(call):
+	""" Find the country of the callsign
+	Exact calls are checked first, otherwise the country of the longest
+	matching prefix is returned
+	Results are memoized, find.cache_info() returns the hit/miss counters
+	"""
+	ensure_loaded()
 	if call in fixcalls:
 		code = fixcalls[call]
 	else:
-		cprefixes = [x for x in prefixes if call.startswith(x[0])]
-		if cprefixes:
-			code = max(cprefixes, key = lambda z: len(z[0]))[1]
-		else:
+		code = None
+		node = prefixes
+		for c in call:
+			node = node.get(c)
+			if node is None:
+				break
+			code = node.get(None, code)
+		if code is None:
 			raise ValueError('Unrecognized callsign')
 	return code, countries[code]
 
+
+def find_many(calls):
+	""" Find the country of multiple callsigns in one pass
+	Return a dict mapping every distinct callsign to the (code, info) tuple
+	returned by find()
+	"""
+	result = {}
+	for call in calls:
+		if call not in result:
+			try:
+				result[call] = find(call)
+			except ValueError:
+				raise ValueError('Unrecognized callsign: {}'.format(call))
+	return result
+
 country_alias = {
 	'*4U1V': '4U1U',
 	'*GM/s': 'GM',
@@ -64,5 +191,6 @@ def fix4dxcc(code):
 	return country_alias.get(code, code)
 
 def country_name(code):
+	ensure_loaded()
 	name = countries[code]['name']
 	return country_name_fix.get(name, name)
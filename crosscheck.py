@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+""" Cross-check of contest logs
+The submitted cabrillo logs of a contest are checked against each other and
+every qso is classified:
+  ok - the other station logged the same contact
+  B  - busted call, the logged callsign was copied wrong, the station with
+       a similar call has the contact in its log
+  U  - unique call, the station did not submit a log and nobody else worked it
+  N  - not in log, the station submitted a log but the contact is missing
+  X  - the received exchange does not match the exchange sent by the other
+       station
+  T  - the contact was found, but the logged times differ more than allowed
+All qsos are indexed by (logging call, worked call, band, mode) with the qso
+times sorted, so the matching contact is found with a binary search instead
+of scanning the other logs.
+"""
+
+import sys
+import bisect
+import argparse
+
+import cabrillo
+import contest
+
+
+# maximum time difference (in minutes) of two matching qsos
+match_window = 10
+# time difference (in minutes) reported as time mismatch
+time_tolerance = 2
+
+status_names = {
+    'ok': 'ok',
+    'B': 'busted',
+    'U': 'unique',
+    'N': 'not in log',
+    'X': 'exchange mismatch',
+    'T': 'time mismatch',
+}
+
+
+def qso_minutes(qso):
+    """ Return the time of the qso in minutes, comparable across days
+    """
+    return qso.date.toordinal() * 1440 + qso.time[0] * 60 + qso.time[1]
+
+
+def similar_calls(a, b):
+    """ Check if the two callsigns differ by at most one character
+    (one changed, missing or extra character)
+    """
+    if a == b:
+        return True
+    if len(a) == len(b):
+        return sum(x != y for x,y in zip(a, b)) == 1
+    if len(a) > len(b):
+        a, b = b, a
+    if len(b) - len(a) != 1:
+        return False
+    for i in range(len(a)):
+        if a[i] != b[i]:
+            return a[i:] == b[i+1:]
+    return True
+
+
+class CheckedQSO:
+    """ A qso of a submitted log with the result of the cross-check
+    The status is one of the keys of status_names, problems found on a
+    matched qso (X, T) are listed in the problems, the detail describes the
+    problem (correct call, exchange or time difference)
+    """
+    __slots__ = ('qso', 'key', 'minutes', 'match', 'status', 'problems', 'detail')
+
+    def __init__(self, qso, key):
+        self.qso = qso
+        self.key = key
+        self.minutes = qso_minutes(qso)
+        self.match = None
+        self.status = None
+        self.problems = []
+        self.detail = []
+
+
+class Log:
+    """ A submitted log: the callsign, the cabrillo header fields and the
+    cross-checked qsos
+    """
+    def __init__(self, fields, qsos, name=None):
+        self.fields = fields
+        self.name = name
+        self.callsign = fields.get('callsign', '').upper()
+        self.qsos = []
+        for qso in qsos:
+            callsign, band, mode = contest.qso_key(qso.callsign, qso.freq, qso.mode)
+            self.qsos.append(CheckedQSO(qso, (self.callsign, callsign, band, mode)))
+
+
+    def summary(self):
+        """ Return the number of qsos by status
+        """
+        count = dict.fromkeys(status_names, 0)
+        for q in self.qsos:
+            count[q.status] += 1
+            for p in q.problems:
+                count[p] += 1
+        return count
+
+
+class CrossCheck:
+    """ Cross-check engine, the logs are added one by one, then check
+    classifies all the qsos
+    """
+    def __init__(self, window=match_window, tolerance=time_tolerance):
+        self.window = window
+        self.tolerance = tolerance
+        self.logs = []
+        # (logging call, worked call, band, mode) -> ([times], [qsos])
+        self.pairs = {}
+        # (worked call, band, mode) -> ([times], [qsos]), for busted calls
+        self.worked = {}
+        # number of logs containing the call
+        self.calls = {}
+
+
+    def add_log(self, fields, qsos, name=None):
+        """ Add a log read from a cabrillo file
+        """
+        log = Log(fields, qsos, name)
+        self.logs.append(log)
+        return log
+
+
+    def read(self, handle):
+        """ Read a cabrillo log from the handle and add it to the check
+        """
+        fields, qsos = cabrillo.read(handle)
+        return self.add_log(fields, qsos, getattr(handle, 'name', None))
+
+
+    def build_index(self):
+        pairs = {}
+        worked = {}
+        calls = {}
+        for log in self.logs:
+            seen = set()
+            for q in log.qsos:
+                pairs.setdefault(q.key, []).append(q)
+                worked.setdefault(q.key[1:], []).append(q)
+                seen.add(q.key[1])
+            for call in seen:
+                calls[call] = calls.get(call, 0) + 1
+        for index in (pairs, worked):
+            for key, qsos in index.items():
+                qsos.sort(key=lambda q: q.minutes)
+                index[key] = ([q.minutes for q in qsos], qsos)
+        self.pairs = pairs
+        self.worked = worked
+        self.calls = calls
+
+
+    def nearest(self, index, key, minutes, accept):
+        """ Return the unmatched qso of the index entry closest in time to
+        the given one, within the matching window
+        """
+        entry = index.get(key)
+        if not entry:
+            return None
+        times, qsos = entry
+        lo = bisect.bisect_left(times, minutes - self.window)
+        hi = bisect.bisect_right(times, minutes + self.window)
+        best = None
+        for i in range(lo, hi):
+            q = qsos[i]
+            if q.match is None and accept(q) and (
+                    best is None or abs(q.minutes - minutes) < abs(best.minutes - minutes)):
+                best = q
+        return best
+
+
+    def check(self):
+        """ Cross-check all the logs and set the status of every qso
+        The exact matches are paired first, then the busted calls are linked
+        to the contact logged by the station with the similar call, so only
+        the station copying the call wrong is penalized
+        """
+        self.build_index()
+        submitted = {log.callsign for log in self.logs}
+        for log in self.logs:
+            for q in log.qsos:
+                if q.match is None:
+                    own, other, band, mode = q.key
+                    m = self.nearest(self.pairs, (other, own, band, mode), q.minutes,
+                                     lambda x: x is not q)
+                    if m:
+                        q.match = m
+                        m.match = q
+        for log in self.logs:
+            for q in log.qsos:
+                if q.match is None:
+                    self.busted(q)
+        for log in self.logs:
+            for q in log.qsos:
+                if q.status == 'B':
+                    continue
+                if q.match is not None:
+                    self.compare(q)
+                else:
+                    self.unmatched(q, submitted)
+
+
+    def busted(self, q):
+        """ Look for the contact of a station with a call similar to the
+        logged one, mark the qso busted and link the contact to it
+        """
+        own, other, band, mode = q.key
+        m = self.nearest(self.worked, (own, band, mode), q.minutes,
+                         lambda x: x.key[0] != other and similar_calls(x.key[0], other))
+        if m:
+            q.status = 'B'
+            q.detail.append(m.key[0])
+            q.match = m
+            m.match = q
+
+
+    def unmatched(self, q, submitted):
+        """ Classify a qso without the matching contact in the other log
+        """
+        other = q.key[1]
+        if other in submitted:
+            q.status = 'N'
+        elif self.calls.get(other, 0) <= 1:
+            q.status = 'U'
+        else:
+            # can not be checked, other stations worked it too
+            q.status = 'ok'
+
+
+    def compare(self, q):
+        """ Compare a qso with the matching contact of the other log
+        """
+        q.status = 'ok'
+        m = q.match
+        if (q.qso.exch or '').upper() != (m.qso.exch_sent or '').upper():
+            q.problems.append('X')
+            q.detail.append(m.qso.exch_sent)
+        diff = abs(q.minutes - m.minutes)
+        if diff > self.tolerance:
+            q.problems.append('T')
+            q.detail.append("{}min".format(diff))
+
+
+def format_qso(q):
+    qso = q.qso
+    return "{} {:02}{:02} {:>10} {:4} {:13} {}".format(
+        qso.date.isoformat(), qso.time[0], qso.time[1], qso.freq, qso.mode,
+        qso.callsign, qso.exch)
+
+
+def print_report(check, handle=sys.stdout, verbose=False):
+    """ Print the UBN report of every log, listing the qsos with problems
+    (all the qsos if verbose)
+    """
+    for log in check.logs:
+        count = log.summary()
+        print("{} ({}): {} qsos, {}".format(
+            log.callsign, log.name or '-', len(log.qsos),
+            ", ".join("{} {}".format(count[k], v) for k,v in status_names.items())),
+            file=handle)
+        for q in log.qsos:
+            flags = ([] if q.status == 'ok' else [q.status]) + q.problems
+            if flags or verbose:
+                print("  {:3} {} {}".format(
+                    ''.join(flags) or 'ok', format_qso(q), ' '.join(q.detail)).rstrip(),
+                    file=handle)
+
+
+if __name__ == '__main__':
+    # parse arguments
+    parser = argparse.ArgumentParser(description='Cross-check of contest cabrillo logs')
+    parser.add_argument('logs', nargs='+', type=argparse.FileType('r', encoding='UTF-8'),
+                        help='Cabrillo logs submitted for the contest')
+    parser.add_argument('-w', '--window', type=int, default=match_window,
+                        help='Maximum time difference of matching qsos in minutes')
+    parser.add_argument('-t', '--tolerance', type=int, default=time_tolerance,
+                        help='Time difference reported as mismatch in minutes')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='List all the qsos, not only the ones with problems')
+    args = parser.parse_args()
+
+    check = CrossCheck(args.window, args.tolerance)
+    for f in args.logs:
+        try:
+            check.read(f)
+        except ValueError as e:
+            print("{}: {}".format(f.name, e), file=sys.stderr)
+            sys.exit(1)
+        f.close()
+    check.check()
+    print_report(check, verbose=args.verbose)
@@ -63,13 +63,21 @@ Example of input file:
 """
 import sys
 import re
-from datetime import date
+from datetime import date, timedelta
 import os.path
 import argparse
 import json
-
-from contest import Contest
+import functools
+import io
+import concurrent.futures
+import hashlib
+import pickle
+
+from contest import Contest, find_rules
+import adif
+import bandplan
 import country
+import output
 import qslinfo
 
 
@@ -87,7 +95,6 @@ wwff_ref = re.compile(r"[a-z0-9]{1,2}f{2}-[0-9]{3,4}", re.I)
 locator = re.compile(r"[a-x]{2}[0-9]{2}[a-x]{2}", re.I)
 date_reg = re.compile(r"([0-9]{4})(?P<sep>[.-])([0-9]{2})(?P=sep)([0-9]{2})")
 time_reg = re.compile(r"(?P<hour>0?[0-9]|1[0-9]|2[0-3])?((?(hour)[0-5]|[0-5]?)[0-9])")
-freq = re.compile(r"((?:[0-9]+\.)?[0-9]+)([kMG]?Hz|[mc]?m)?")
 rst = re.compile(r"[1-5][1-9][1-9]?")
 word = re.compile(r"\S+")
 contest = re.compile(r"contest:(\w+)\s*")
@@ -105,35 +112,6 @@ def find_word(string, start=0):
     return string[start:end], start, end
 
 
-bands = {
-    '160m'   : ( 1.8, 2.0 ),
-    '80m'    : ( 3.5, 4.0 ),
-    '40m'    : ( 7.0, 7.3 ),
-    '30m'    : ( 10.1, 10.15 ),
-    '20m'    : ( 14.0, 14.35 ),
-    '17m'    : ( 18.068, 18.168 ),
-    '15m'    : ( 21.0, 21.45 ),
-    '12m'    : ( 24.89, 24.99 ),
-    '10m'    : ( 28.0, 29.7 ),
-    '6m'     : ( 50.0, 54.0 ),
-    '2m'     : ( 144.0, 148.0 ),
-    '1.25m'  : ( 219.0, 225.0 ),
-    '70cm'   : ( 420.0, 450.0 ),
-    '35cm'   : ( 902.0, 928.0 ),
-    '23cm'   : ( 1240.0, 1300.0 ),
-    '13cm'   : ( 2300.0, 2450.0 ),
-    '9cm'    : ( 3400.0, 3475.0 ),
-    '6cm'    : ( 5650.0, 5850.0 ),
-    '3cm'    : ( 10000.0, 10500.0 ),
-    '1.25cm' : ( 24000.0, 24250.0 ),
-    '6mm'    : ( 47000.0, 47200.0 ),
-    '4mm'    : ( 75500.0, 81500.0 ),
-    '2.5mm'  : ( 122250.0, 123000.0 ),
-    '2mm'    : ( 134000.0, 141000.0 ),
-    '1mm'    : ( 241000.0, 250000.0 ),
-}
-
-
 def match_freq(s):
     # check if the string s is a correct amateur band frequency
     # return the string if it is or False otherwise
@@ -142,28 +120,140 @@ def match_freq(s):
     # frequency can either specify the unit, or be a single number
     # which is considered to be in MHz, if unit is not MHz if will
     # be converted, or if missing will be added to output string
-    m = freq.fullmatch(s)
+    m = bandplan.lookup(s)
     if not m:
         return False
-    mul = 1.0
-    if m.group(2):
-        if s.endswith('m'):
-            if s in bands:
-                return s
-            else:
-                return False
-        if m.group(2) == kHz:
-            mul = 0.001
-        elif m.group(2) == GHz:
-            mul = 1000.0
-    n = float(m.group(1)) * mul
-    for f in bands.values():
-        if n >= f[0] and n <= f[1]:
-            if mul == 1.0:
-                return m.group(1) + 'MHz'
-            else:
-                return "{:.3f}MHz".format(n)
-    return False
+    return m[0]
+
+
+# word types used by the qso parser, each type is a bit in a type mask
+T_TIME = 1
+T_CALL = 2
+T_FREQ = 4
+T_MODE = 8
+T_RST = 16
+T_EXCH = 32
+T_SOTA = 64
+T_QSL = 128
+
+# order of the fields in a qso line
+typeorder = [T_TIME, T_CALL, T_FREQ, T_MODE, T_RST, T_RST, T_EXCH, T_SOTA]
+# types a word can have based on its position in the line
+position_types = [
+    T_TIME | T_CALL | T_FREQ | T_MODE | T_RST | T_EXCH | T_SOTA | T_QSL,
+    T_CALL | T_FREQ | T_MODE | T_RST | T_EXCH | T_SOTA | T_QSL,
+    T_FREQ | T_MODE | T_RST | T_EXCH | T_SOTA | T_QSL,
+    T_MODE | T_RST | T_EXCH | T_SOTA | T_QSL,
+    T_RST | T_EXCH | T_SOTA | T_QSL,
+    T_RST | T_EXCH | T_SOTA | T_QSL,
+    T_EXCH | T_SOTA | T_QSL,
+    T_SOTA | T_QSL,
+]
+
+# shared time tuples for the qsos
+qso_times = [[(h, m) for m in range(60)] for h in range(24)]
+
+# TODO: add all possible modes and translations
+modes = {
+    'cw': 'CW', 'ssb': 'SSB', 'fm': 'FM', 'am': 'AM',
+    'data': 'Data', 'psk': 'Data', 'psk31': 'Data', 'psk63': 'Data',
+    'rtty': 'Data', 'fsk441': 'Data', 'jt65': 'Data', 'ft8': 'Data',
+    'other': 'Other',
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def classify_word(w, exchange=None):
+    """Find all the types a word of a qso line can have
+    Return the mask of the possible types and a dict with the value of the
+    word for each type. Only the patterns which can match based on the first
+    character of the word are tried and the results are memoized, as the
+    same words repeat over and over in a log.
+    """
+    mask = 0
+    values = {}
+    c = w[0]
+    if c.isdigit():
+        m = time_reg.fullmatch(w)
+        if m:
+            mask |= T_TIME
+            minute = int(m.group(2))
+            values[T_TIME] = qso_times[int(m.group(1))][minute] if m.group(1) else (None, minute)
+        m = match_freq(w)
+        if m:
+            mask |= T_FREQ
+            values[T_FREQ] = m
+        if rst.fullmatch(w):
+            mask |= T_RST
+            values[T_RST] = w
+    elif c in '@%$':
+        if annotation.fullmatch(w):
+            mask |= T_QSL
+            values[T_QSL] = (w[0], w[1:])
+    elif w.lower() in modes:
+        mask |= T_MODE
+        values[T_MODE] = modes[w.lower()]
+
+    if c.isalnum():
+        if call.fullmatch(w):
+            mask |= T_CALL
+            values[T_CALL] = w.upper()
+        if sota_ref.fullmatch(w):
+            mask |= T_SOTA
+            values[T_SOTA] = w.upper()
+
+    if exchange and exchange.fullmatch(w):
+        mask |= T_EXCH
+        values[T_EXCH] = w
+
+    return mask, values
+
+
+@functools.lru_cache(maxsize=1024)
+def assign_fields(masks, count):
+    """Assign the words of a qso line to the qso fields
+    The masks contain the possible types of the first words of the line and
+    count is the number of words in the line.
+    Return the index of the word assigned to each field of the type order
+    (None if the field is missing) and the index of the first word of notes
+    """
+    wlist = [None, None, None, None, None, None, None, None]
+
+    lastelem = -1
+    noteselem = 7
+    for i in range(count):
+        mask = masks[i] if i < len(masks) else 0
+        for e in range(lastelem + 1, len(typeorder)):
+            if typeorder[e] & mask:
+                lastelem = e
+                wlist[e] = i
+                break
+        else:
+            noteselem = i
+            break
+
+    # try to move back multiple mapped words
+    felist = [(i+2,w) for i,w in enumerate(wlist[2:6]) if w is not None]
+    for i in range(6,3,-1):
+        if wlist[i] is None and felist and typeorder[i] & masks[felist[-1][1]]:
+            wlist[i] = felist[-1][1]
+            wlist[felist[-1][0]] = None
+            felist.pop()
+        if felist and felist[-1][0] == i:
+            felist.pop()
+
+    return tuple(wlist), noteselem
+
+
+def word_offset(string, index):
+    """Return the position of a word of a qso line given by its index
+    The lines are split without positions, these are needed only for the
+    error messages
+    """
+    for i, m in enumerate(word.finditer(string)):
+        if i == index:
+            return m.start()
+    return 0
 
 
 def quote_text(string):
@@ -264,34 +354,68 @@ class Activation:
             self.qsos.append(QSO(string, prev_qso))
 
 
-    def print_qsos(self, format='SOTA_v2', config=None, handle=None, qsl_info=None):
-        if self.previous:
-            self.previous.print_qsos(format, config, handle, qsl_info)
+    def print_qsos(self, format='SOTA_v2', config=None, handle=None, qsl_info=None, header=True):
+        """Print the qsos of all the activations linked to this one,
+        starting with the first one
+        """
+        chain = []
+        activation = self
+        while activation:
+            chain.append(activation)
+            activation = activation.previous
+        sink = output.open_sink(handle)
+        for activation in reversed(chain):
+            activation.print_activation(format, config, sink, qsl_info, header)
+            header = False
+        sink.flush()
+
+
+    def print_activation(self, format='SOTA_v2', config=None, handle=None, qsl_info=None, header=True):
+        """Print the qsos of this activation only
+        The output is written through a buffered sink, if the handle is not
+        already a sink then the output is flushed when done
+        If the output format has a file header it is printed only if header
+        is set
+        """
+        sink = output.open_sink(handle)
+        try:
+            self.write_activation(sink, format, config, qsl_info, header)
+        finally:
+            if sink is not handle:
+                sink.flush()
+
 
+    def write_activation(self, handle, format, config, qsl_info, header):
         # TODO: trace, remove it from final code
         #print("Processing {} from {} with callsign {}".format(
         #    "chase" if not self.ref else "activation of {}".format(self.ref),
         #   self.date.strftime("%Y-%m-%d"), self.callsign))
 
-        # TODO: only SOTA_v2 is understood as of now
         if format == 'SOTA_v2':
-            sota_line = ['v2', self.callsign, self.ref, self.date.strftime("%d/%m/%Y")] + [''] * 6
-            for qso in self.qsos:
-                sota_line[4] = '{:02}{:02}'.format(qso.time[0], qso.time[1])
-                sota_line[5] = qso.freq
-                sota_line[6] = qso.mode
-                sota_line[7] = qso.callsign
-                sota_line[8] = getattr(qso, 'ref', '')
-                sota_line[9] = quote_text(qso.notes)
-                #sota_line[9] = quote_text(' '.join((qso.sent, qso.rcvd, qso.notes)))
-                print(','.join(sota_line), file=handle)
+            sota_line = 'v2,{},{},{},'.format(self.callsign, self.ref, self.date.strftime("%d/%m/%Y"))
+            handle.write_lines(
+                '{}{:02}{:02},{},{},{},{},{}'.format(
+                    sota_line, qso.time[0], qso.time[1], qso.freq, qso.mode, qso.callsign,
+                    getattr(qso, 'ref', ''),
+                    # notes are usually empty, quote only if needed
+                    quote_text(qso.notes) if qso.notes else '')
+                    #quote_text(' '.join((qso.sent, qso.rcvd, qso.notes)))
+                for qso in self.qsos)
+        # adif format: the records are streamed directly from the qsos
+        elif format == 'adif':
+            if header:
+                handle.write(adif.header())
+            handle.write_lines(
+                adif.qso_record(qso, self.date + timedelta(days=qso.day), self.callsign, self.ref)
+                for qso in self.qsos)
         # contest format: if a contest was specified for an activation
         # use the contest rules to determine the output format
-        elif format == 'contest' and self.contest:
-            self.contest.configure(self, config)
-            for qso in self.qsos:
-                self.contest.add_qso(self.callsign, self.date, qso)
-            print(self.contest, file=handle)
+        elif format == 'contest':
+            # activations without contest have no contest output
+            if self.contest:
+                self.contest.configure(self, config)
+                self.contest.add_qsos(self.callsign, self.date, self.qsos)
+                self.contest.write(handle)
         # qsl status format:
         # group callsigns by country and add qsl marker:
         #  * - sent, but not confirmed yet
@@ -318,136 +442,77 @@ class QSO:
     """Class containing information about a qso
     It is initialized from a string and a previous qso object.
     Missing fields from the string are filled with data from previous qso
+    The optional fields (exch, ref, qsl_sent, qsl_rcvd) are only set if
+    present in the string.
+    The qsos use slots and share the strings and time tuples repeating
+    in a log, to keep large archives compact in memory.
     """
 
+    __slots__ = ('time', 'callsign', 'freq', 'mode', 'sent', 'rcvd', 'exch',
+                 'ref', 'notes', 'qsl_sent', 'qsl_rcvd', 'day')
+
     def __init__(self, string, prev=None, exchange=None):
         """Initialize qso data with the following information:
         time callsign freq mode rst_sent rest_rcvd SOTA_ref notes
         """
 
-        words = [(m.group(), m.start(), {}) for m in word.finditer(string)]
+        words = string.split()
         if not words:
             raise LogException("Empty QSO", 0)
 
-        # try to match words into categories
-        for i,w in enumerate(words):
-            t = w[2]
-            # time
-            if i < 1:
-                m = time_reg.fullmatch(w[0])
-                if m:
-                    t['time'] = (int(m.group(1)) if m.group(1) else None, int(m.group(2)))
-            # callsign
-            if i < 2:
-                m = call.fullmatch(w[0])
-                if m:
-                    t['call'] = w[0].upper()
-            # freq
-            if i < 3:
-                m = match_freq(w[0])
-                if m:
-                    t['freq'] = m
-            # mode
-            # TODO: add all possible modes and translations
-            if i < 4:
-                if w[0].lower() in ['cw', 'ssb', 'fm', 'am']:
-                    t['mode'] = w[0].upper()
-                elif w[0].lower() in ['data', 'psk', 'psk31', 'psk63', 'rtty', 'fsk441', 'jt65', 'ft8']:
-                    t['mode'] = 'Data'
-                elif w[0].lower() in ['other']:
-                    t['mode'] = 'Other'
-            # rst
-            if i < 6:
-                m = rst.fullmatch(w[0])
-                if m:
-                    t['rst'] = w[0]
-            # sota ref
-            m = sota_ref.fullmatch(w[0])
-            if m:
-                t['sota'] = w[0].upper()
-
-            # optional contest exchange
-            if exchange and i < 7:
-                m = exchange.fullmatch(w[0])
-                if m:
-                    t['exch'] = w[0]
-
-            # annotation about QSLing
-            m = annotation.fullmatch(w[0])
-            if m:
-                t['qsl'] = (w[0][0], w[0][1:])
-
-
-        # now filter the type list
-        # print(words)
-
-        typeorder = ['time', 'call', 'freq', 'mode', 'rst', 'rst', 'exch', 'sota']
-        wlist = [None, None, None, None, None, None, None, None]
-
-        lastelem = -1
-        noteselem = 7
-        for i,w in enumerate(words):
-            for e in range(lastelem + 1, len(typeorder)):
-                if typeorder[e] in w[2]:
-                    lastelem = e
-                    wlist[e] = w
-                    break
-            else:
-                noteselem = i
-                break
-
-        # try to move back multiple mapped words
-        felist = [(i+2,w) for i,w in enumerate(wlist[2:6]) if w]
-        for i in range(6,3,-1):
-            if wlist[i] is None and felist and typeorder[i] in felist[-1][1][2]:
-                wlist[i] = felist[-1][1]
-                wlist[felist[-1][0]] = None
-                felist.pop()
-            if felist and felist[-1][0] == i:
-                felist.pop()
-
-        # check for minimum change
+        # classify the words: each word gets a mask of the possible types
+        # and the values for each type, then the fields are assigned based on
+        # the masks limited by the position of the words
+        types = [classify_word(w, exchange) for w in words]
+        fields, noteselem = assign_fields(
+            tuple([t[0] & p for t,p in zip(types, position_types)]), len(words))
+        wlist = [types[i][1][t] if i is not None else None
+                 for i,t in zip(fields, typeorder)]
+
+        # check for minimum change, the error points at the first word not
+        # assigned to a field
         if wlist[1] is None and wlist[2] is None and wlist[3] is None:
-            raise LogException("Invalid change from previous QSO", words[i][1])
+            raise LogException("Invalid change from previous QSO",
+                               word_offset(string, noteselem if noteselem < len(words) else 0))
 
         # now recreate all elements
 
         # time
-        if wlist[0] is None or wlist[0][2]['time'][0] is None:
+        if wlist[0] is None or wlist[0][0] is None:
             if prev is None:
                 raise LogException("Missing time value", 0)
             if wlist[0] is not None:
-                self.time = (prev.time[0], wlist[0][2]['time'][1])
-                if self.time[1] < prev.time[1]:
-                    hour = self.time[0] + 1
+                hour = prev.time[0]
+                if wlist[0][1] < prev.time[1]:
+                    hour += 1
                     if hour == 24:
                         hour = 0
-                    self.time = (hour, self.time[1])
+                self.time = qso_times[hour][wlist[0][1]]
             else:
                 self.time = prev.time
         else:
-            self.time = wlist[0][2]['time']
+            self.time = wlist[0]
         # call
         if wlist[1] is None:
             if prev is None:
                 raise LogException("Missing callsign", 0)
             self.callsign = prev.callsign
         else:
-            self.callsign = wlist[1][2]['call']
+            self.callsign = sys.intern(wlist[1])
         # freq
         if wlist[2] is None:
             if prev is None:
                 raise LogException("Missing frequency", 0)
             self.freq = prev.freq
         else:
-            self.freq = wlist[2][2]['freq']
+            self.freq = sys.intern(wlist[2])
         # mode
         if wlist[3] is None:
             if prev is None:
                 raise LogException("Missing mode", 0)
             self.mode = prev.mode
         else:
-            self.mode = wlist[3][2]['mode']
+            self.mode = wlist[3]
         # rst
         if self.mode == 'CW' or self.mode == 'Data':
             def_rst = '599'
@@ -457,40 +522,42 @@ class QSO:
         if wlist[4] is None:
             self.sent = def_rst
         else:
-            if len(wlist[4][2]['rst']) != len(def_rst):
-                raise LogException("Invalid RST for this mode", 0)
-            self.sent = wlist[4][2]['rst']
+            if len(wlist[4]) != len(def_rst):
+                raise LogException("Invalid RST for this mode", word_offset(string, fields[4]))
+            self.sent = wlist[4]
 
         if wlist[5] is None:
             self.rcvd = def_rst
         else:
-            if len(wlist[5][2]['rst']) != len(def_rst):
-                raise LogException("Invalid RST for this mode", 0)
-            self.rcvd = wlist[5][2]['rst']
+            if len(wlist[5]) != len(def_rst):
+                raise LogException("Invalid RST for this mode", word_offset(string, fields[5]))
+            self.rcvd = wlist[5]
 
         # optional exchange
         if wlist[6] is not None:
-            self.exch = wlist[6][2]['exch']
+            self.exch = wlist[6]
 
         # SOTA ref
         if wlist[7] is not None:
-            self.ref = wlist[7][2]['sota']
+            self.ref = wlist[7]
 
         # notes
         if noteselem < len(words):
-            self.notes = ' '.join(x[0] for x in words[noteselem:] if 'qsl' not in x[2])
+            self.notes = ' '.join(words[i] for i in range(noteselem, len(words))
+                                  if not types[i][0] & T_QSL)
         else:
             self.notes = ''
 
         # qsl info
-        q = [x[2]['qsl'] for x in words[noteselem:] if 'qsl' in x[2]]
+        q = [types[i][1][T_QSL] for i in range(noteselem, len(words))
+             if types[i][0] & T_QSL]
         if q:
             self.qsl_sent = q[0][0]
             self.qsl_rcvd = q[0][1]
 
         # day adjustment for multiple day activation
         if prev:
-            if prev.time[0] * 60 + prev.time[1] > self.time[0] * self.time[1]:
+            if prev.time[0] * 60 + prev.time[1] > self.time[0] * 60 + self.time[1]:
                 self.day = prev.day + 1
             else:
                 self.day = prev.day
@@ -498,7 +565,39 @@ class QSO:
             self.day = 0
 
 
-def parse_input(input_handle, output_handle=None, output_name='', **params):
+def output_filename(output_name, activation, input_handle, format=None):
+    """Build the name of the output file for an input file
+    """
+    return output_name.format(
+        callsign = call.fullmatch(activation.callsign).group(1),
+        file = os.path.splitext(os.path.basename(input_handle.name))[0],
+        ext = (activation.contest.output.ext if format == 'contest' and activation.contest else
+               output_ext.get(format, 'csv'))
+    )
+
+
+# extension of the output files by output format
+output_ext = {
+    'adif': 'adi',
+}
+
+
+def print_errors(errors, input_handle, error_handle=None):
+    for e in errors:
+        print("{}:{}: {}\n {}\n {:>{}}".format(
+            input_handle.name, e[0], e[1], e[2], '^', e[3] + 1),
+            file=error_handle or sys.stderr)
+
+
+def parse_input(input_handle, output_handle=None, output_name='', stream=False, error_handle=None, **params):
+    """Parse a log file and print the output for all the activations in it
+    Normally the whole file is parsed first and nothing is printed if any
+    error is found. In stream mode each activation is printed as soon as the
+    next activation starts (or the input ends) and dropped afterwards, so
+    only one activation is kept in memory. Activations with errors are
+    skipped and the errors are reported as they are found.
+    Return the last activation printed, None if nothing was printed
+    """
     comment_line = False
     blank_line = False
     possible_blank_line = False
@@ -506,6 +605,31 @@ def parse_input(input_handle, output_handle=None, output_name='', **params):
     qso = None
     errors = []
     cnt = 0
+    # in stream mode: errors before the current activation started,
+    # None if the current activation can not be printed
+    activation_errors = None
+    output_file = None
+    printed = None
+    header = params.pop('header', True)
+
+    def flush():
+        nonlocal output_file, header, printed
+        if activation is None or activation_errors != len(errors):
+            return
+        if output_handle:
+            handle = output_handle
+        elif output_name:
+            if not output_file:
+                output_file = open(output_filename(output_name, activation, input_handle, params.get('format')),
+                                   'w', encoding='utf-8')
+            handle = output_file
+        else:
+            handle = sys.stdout
+        activation.print_activation(handle=handle, header=header, **params)
+        header = False
+        printed = activation
+        handle.flush()
+
     # go though the lines
     for line in input_handle:
         cnt += 1
@@ -530,32 +654,199 @@ def parse_input(input_handle, output_handle=None, output_name='', **params):
         # if previous line was a blank line
         try:
             if blank_line or not activation:
+                if stream:
+                    flush()
+                    activation_errors = None
                 activation = Activation(s, activation)
                 blank_line = False
+                if stream:
+                    activation.previous = None
+                    activation_errors = len(errors)
             else:
                 activation.add_qso(s)
         except LogException as e:
             errors.append((cnt, str(e), s, e.pos))
+            if stream:
+                print_errors(errors[-1:], input_handle, error_handle)
+
+    if stream:
+        flush()
+        if output_file:
+            output_file.close()
+        return printed
 
     # if any error found, print it on stderr
     if errors:
-        for e in errors:
-            print("{}:{}: {}\n {}\n {:>{}}".format(
-                input_handle.name, e[0], e[1], e[2], '^', e[3] + 1),
-                file=sys.stderr)
-    else:
+        print_errors(errors, input_handle, error_handle)
+    elif activation:
+        printed = activation
         if output_handle:
-            activation.print_qsos(handle=output_handle, **params)
+            activation.print_qsos(handle=output_handle, header=header, **params)
         elif output_name:
-            filename = output_name.format(
-                callsign = call.fullmatch(activation.callsign).group(1),
-                file = os.path.splitext(os.path.basename(input_handle.name))[0],
-                ext = activation.contest.output.ext if params.get('format') == 'contest' else 'csv'
-            )
+            filename = output_filename(output_name, activation, input_handle, params.get('format'))
             with open(filename, 'w', encoding='utf-8') as f:
                 activation.print_qsos(handle=f, **params)
         else:
-            activation.print_qsos(**params)
+            activation.print_qsos(header=header, **params)
+    return printed
+
+
+class QSLUpdates:
+    """Collect the qsos of the activations in the same way as the QSL class,
+    so they can be added to the qsl information later
+    """
+    def __init__(self):
+        self.updates = []
+
+
+    def add_qsos(self, qsos, qso_date):
+        self.updates.append((qsos, qso_date))
+
+
+def file_params(file, params):
+    """Return the parameters for parsing the given file
+    For contest output a contest config file with the same name as the log
+    file is used if it exists
+    """
+    params = dict(params)
+    if params.get('format') == 'contest':
+        config = os.path.splitext(file)[0] + '.cts'
+        if os.path.isfile(config):
+            params['config'] = config
+    return params
+
+
+def convert_file(file, params):
+    """Convert a single log file, used by the worker processes and the cache
+    Return the error messages, the generated output, the name of the output
+    file it was written to (None if the output goes to the main output) and
+    the qsl updates. These are processed by the main process in the order of
+    the input files. Output files are written directly, their content is not
+    returned
+    """
+    params = file_params(file, params)
+    output_name = params.get('output_name')
+    errors = io.StringIO()
+    text = io.StringIO()
+    filename = None
+    updates = None
+    if params.get('format') == 'qsl':
+        updates = QSLUpdates()
+        params['qsl_info'] = updates
+    if not output_name:
+        params['output_handle'] = text
+    try:
+        with open(file, 'r', encoding='utf-8') as f:
+            activation = parse_input(f, error_handle=errors, **params)
+            if output_name and activation:
+                filename = output_filename(output_name, activation, f, params.get('format'))
+                if not os.path.isfile(filename):
+                    filename = None
+    except (OSError, ValueError) as e:
+        print('{}: {}'.format(file, e), file=errors)
+    return errors.getvalue(), text.getvalue(), filename, updates.updates if updates else None
+
+
+def output_version(filename):
+    """Return the size and modification time of an output file, None if
+    there is no output file or it does not exist
+    """
+    if not filename:
+        return None
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+# version of the cached conversion results, change it whenever the output
+# or the cached types change
+CACHE_VERSION = 3
+
+# contest declarations of the activations, as found in the raw log lines
+contest_name = re.compile(rb"contest:(\w+)")
+
+
+class ConversionCache:
+    """Persistent cache of the converted log files
+    The conversion results are stored in a directory, keyed on the hash of
+    the log file content and the conversion parameters, so unchanged files
+    are not parsed again
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+
+    def key(self, file, params):
+        """Return the cache key of a log file converted with the given
+        parameters, or None if the file can not be read
+        """
+        params = file_params(file, params)
+        h = hashlib.sha256()
+        h.update(repr(CACHE_VERSION).encode())
+        contests = set()
+        try:
+            with open(file, 'rb') as f:
+                if params.get('format') == 'contest':
+                    # the scores depend on the rule files of the contests
+                    for line in f:
+                        h.update(line)
+                        contests.update(contest_name.findall(line))
+                else:
+                    for block in iter(lambda: f.read(1 << 16), b''):
+                        h.update(block)
+            if 'config' in params:
+                with open(params['config'], 'rb') as f:
+                    h.update(f.read())
+            for name in sorted(contests):
+                rules = find_rules(name.decode('utf-8', 'replace'))
+                h.update(repr((name, rules)).encode())
+                if rules:
+                    with open(rules, 'rb') as f:
+                        h.update(f.read())
+        except OSError:
+            return None
+        h.update(repr(sorted((k, v) for k,v in params.items() if k != 'qsl_info')).encode())
+        # scoring and qsl statistics depend on the country database
+        if params.get('format') in ['contest', 'qsl']:
+            try:
+                h.update(repr(country.database_key(country.database)).encode())
+            except OSError:
+                pass
+        return h.hexdigest()
+
+
+    def get(self, key):
+        """Return the cached conversion result or None
+        """
+        if key is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, key), 'rb') as f:
+                result, version = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, TypeError, ValueError):
+            self.misses += 1
+            return None
+        # only the metadata of the output files is cached, convert the file
+        # again if its output file was removed or written since
+        if output_version(result[2]) != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+
+    def put(self, key, result):
+        if key is None:
+            return
+        filename = os.path.join(self.directory, key)
+        with open(filename + '.tmp', 'wb') as f:
+            pickle.dump((result, output_version(result[2])), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + '.tmp', filename)
 
 
 if __name__ == '__main__':
@@ -568,19 +859,38 @@ if __name__ == '__main__':
                         help='Create output for the contest specified in the processed file')
     format_group.add_argument('-q', '--qsl', action='store_true',
                         help='Display QSL status of contacted OM')
+    format_group.add_argument('-a', '--adif', action='store_true',
+                        help='Create ADIF output')
     parser.add_argument('-o', '--output',
                         help='Output file or directory. If not present, the generated output is printed to standard output. If the argument is a directory, then a file with the same name as the input file and a proper extension will be used.')
+    parser.add_argument('--cty',
+                        help='Country database file (cty.dat) used for contest scoring and QSL statistics. If ommited `cty.dat` from the current directory is used')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of files converted in parallel')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='Directory of the conversion cache. Files converted earlier with the same content and options are not converted again')
+    parser.add_argument('--qsl-file', default='qsl.lst',
+                        help='File used for storing qsl information (JSON or sqlite database). If ommited `qsl.lst` is used by default')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Print each activation as soon as it is read, instead of parsing the whole file first. Activations with errors are skipped')
 
     args = parser.parse_args()
 
+    if args.cty:
+        country.set_database(args.cty)
+
     params = {}
+    if args.stream:
+        params['stream'] = True
     if args.contest:
         params['format'] = 'contest'
+    if args.adif:
+        params['format'] = 'adif'
     if args.qsl:
         params['format'] = 'qsl'
         params['qsl_info'] = qslinfo.QSL()
-        if os.path.isfile('qsl.lst'):
-            params['qsl_info'].load('qsl.lst')
+        if os.path.isfile(args.qsl_file):
+            params['qsl_info'].load(args.qsl_file)
 
     if not args.files:
         args.files.append('-')
@@ -591,23 +901,78 @@ if __name__ == '__main__':
         elif len(args.files) != 1 or args.files[0] != '-':
             params['output_handle'] = open(args.output, 'w', encoding='utf-8')
 
-    for file in args.files:
-        if file == '-':
-            parse_input(sys.stdin)
+    # when all files are printed into the same output, a file header (ADIF)
+    # is printed only before the first file having records
+    single_header = args.adif and 'output_name' not in params
+
+    if args.jobs > 1 or args.cache:
+        # files are converted in worker processes (or in this process if
+        # only the cache is used), the results are processed in the order of
+        # the input files
+        cache = ConversionCache(args.cache) if args.cache else None
+        worker_params = {k: v for k,v in params.items() if k not in ['output_handle', 'qsl_info']}
+        if single_header:
+            # the header is printed here, before the first output
+            worker_params['header'] = False
+        if args.jobs > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                args.jobs, initializer=country.set_database, initargs=(country.database,))
+            convert = functools.partial(executor.submit, convert_file)
         else:
-            if args.contest:
-                config = os.path.splitext(handle.name)[0] + '.cts'
-                if os.path.isfile(config):
-                    params['config'] = config
-                elif 'config' in params:
-                    del params['config']
-
-            with open(file, 'r', encoding='utf-8') as f:
-                parse_input(f, **params)
+            executor = None
+            convert = convert_file
+
+        results = []
+        for file in args.files:
+            if file == '-':
+                results.append((None, None, True))
+                continue
+            key = cache.key(file, worker_params) if cache else None
+            result = cache.get(key) if cache else None
+            if result:
+                results.append((key, result, True))
+            else:
+                results.append((key, convert(file, dict(worker_params)), False))
+
+        header = single_header
+        for key, result, cached in results:
+            if result is None:
+                if parse_input(sys.stdin, **dict(params, header=header or not single_header)):
+                    header = False
+                continue
+            if isinstance(result, concurrent.futures.Future):
+                result = result.result()
+            if cache and not cached:
+                cache.put(key, result)
+            errors, text, filename, updates = result
+            sys.stderr.write(errors)
+            if text and not filename:
+                if header:
+                    params.get('output_handle', sys.stdout).write(adif.header())
+                    header = False
+                params.get('output_handle', sys.stdout).write(text)
+            if updates:
+                for qsos, qso_date in updates:
+                    params['qsl_info'].add_qsos(qsos, qso_date)
+
+        if executor:
+            executor.shutdown()
+        if cache:
+            print('Cache: {} files unchanged, {} files converted'.format(cache.hits, cache.misses),
+                  file=sys.stderr)
+    else:
+        for file in args.files:
+            if file == '-':
+                printed = parse_input(sys.stdin, **params)
+            else:
+                with open(file, 'r', encoding='utf-8') as f:
+                    printed = parse_input(f, **file_params(file, params))
+            if single_header and printed:
+                params['header'] = False
 
     if 'output_handle' in params:
-        close(params['output_handle'])
+        params['output_handle'].close()
 
     if 'qsl_info' in params:
-        params['qsl_info'].save('qsl.lst')
+        params['qsl_info'].save(args.qsl_file)
         params['qsl_info'].print_stat()
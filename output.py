@@ -0,0 +1,56 @@
+""" Buffered output sink used by the log converters
+The generated lines are collected in memory and written to the underlying
+file-like object in large blocks instead of one write per line.
+"""
+
+import sys
+
+
+class OutputSink:
+    """ File-like wrapper batching the writes to a handle
+    The handle can be any object with a write method (file, pipe, StringIO),
+    if it is None the standard output is used.
+    The sink can also be used as the file parameter of print
+    """
+    def __init__(self, handle=None, buffer_size=1 << 16):
+        self.handle = handle if handle is not None else sys.stdout
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.size = 0
+
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+        return len(text)
+
+
+    def write_lines(self, lines):
+        """ Write an iterable of lines, each line is terminated by a newline
+        """
+        for line in lines:
+            self.buffer.append(line)
+            self.buffer.append('\n')
+            self.size += len(line) + 1
+            if self.size >= self.buffer_size:
+                self.flush()
+
+
+    def flush(self):
+        """ Write the buffered text into the handle
+        The handle itself is not flushed
+        """
+        if self.buffer:
+            self.handle.write(''.join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+
+def open_sink(handle=None):
+    """ Return a sink for the handle, an existing sink is reused
+    """
+    if isinstance(handle, OutputSink):
+        return handle
+    return OutputSink(handle)
@@ -4,35 +4,16 @@
 and matching with a parsed log
 """
 
-import json
 import datetime
+import bisect
+import os
 import re
 import argparse
 import sys
 
+import adif
 import country
-
-
-def decode_set_hook(keys):
-    """ Decode JSON obj fields containing an array as set instead of list
-    The name of fields which must be changed are given in keys
-    If keys is None then all lists are decoded as sets
-    """
-    def hook(obj):
-        for k in obj.keys():
-            if (keys is None or k in keys):
-                if type(obj[k]) is list:
-                    obj[k] = set(obj[k])
-                elif type(obj[k]) is dict:
-                    obj[k] = decode_set_hook(None)(obj[k])
-        return obj
-    return hook
-
-
-def encode_set_as_list(obj):
-    if type(obj) is set:
-        return sorted(obj)
-    raise TypeError
+import qslstore
 
 
 call_prefix = r"(?:(?=.?[a-z])[0-9a-z]{1,2}(?:(?<=3d)a)?)"
@@ -42,18 +23,49 @@ uk_call = re.compile(r"(?<=^[GM2])[UDJIMW](?=[0-9][a-z])", re.I)
 uk_clubcall = re.compile(r"(?<=^[GM])[PTHNSC](?=[0-9][a-z])", re.I)
 
 
-qsl_types = ('direct$', 'direct', 'bureau')
+qsl_types = ('direct$', 'direct', 'bureau', 'electronic')
 def qsl_ranking(call, key, qsl):
     """ Add qsl information to either sent or received (determined by key)
     qsl information is ranked and higher one is kept
-    the order is: direct$ > direct > bureau
+    the order is: direct$ > direct > bureau > electronic
     """
-    oqsl = getattr(call, key, None)
+    oqsl = call.get(key)
     for q in qsl_types:
         if q == qsl or q == oqsl:
             call[key] = q
             break
 
+
+def fix_received_key(value):
+    """ Move the received qsl stored under the misspelled `qsl_reveived`
+    key of a call entry (or list of entries) to `qsl_received`
+    Return True if any entry was changed
+    """
+    fixed = False
+    for entry in value if type(value) is list else [value]:
+        if 'qsl_reveived' in entry:
+            qsl_ranking(entry, 'qsl_received', entry.pop('qsl_reveived'))
+            fixed = True
+    return fixed
+
+
+# operations recorded in the journal, replayed with the same arguments
+journal_ops = ('set_no_qsl', 'set_qsl_sent_rcvd', 'mark_received', 'change_uk_key', 'merge_calls')
+
+
+class JournalQSO:
+    """ A qso restored from the journal, it has only the fields used when
+    adding qsos to the qsl information
+    """
+    __slots__ = ('callsign', 'time', 'qsl_sent', 'qsl_rcvd')
+
+    def __init__(self, callsign, time, qsl_sent, qsl_rcvd):
+        self.callsign = callsign
+        self.time = tuple(time)
+        self.qsl_sent = qsl_sent
+        self.qsl_rcvd = qsl_rcvd
+
+
 def reduce_UK_call(callsign):
     """ Change the callsign to the English version of it if it belongs to
     one of the UK entities
@@ -67,6 +79,18 @@ def reduce_UK_call(callsign):
     return reduced
 
 
+def count_item(index, group, item, n):
+    """ Add n to the count of an item in a group of a reverse index
+    Items and groups are removed when the count drops to zero
+    """
+    items = index.setdefault(group, {})
+    items[item] = items.get(item, 0) + n
+    if not items[item]:
+        del items[item]
+        if not items:
+            del index[group]
+
+
 class QSL:
     """ This class contains information about all callsigns contacted and
     their qsling status.
@@ -80,47 +104,209 @@ class QSL:
     callsing. When a callsign roams to other country (by CEPT rule) then
     for each separate country a same structured dict is associated and the
     callsign will have a list of these dicts
+
+    The information is loaded from and saved to a storage backend selected
+    by the file name (see qslstore), the callsigns changed since the load
+    are tracked so only those are written by the backends supporting it.
+    The changing operations are also recorded, so they can be appended to
+    a journal instead of writing the whole information
     """
     def __init__(self):
         self.qsl_info = {}
         self.countries = {}
         self.stat_list = {}
-        self.alternate_calls = {}
+        self.reset_indexes()
+        self.store = None
+        # version of the stored information when it was read or written
+        self.version = None
+        self.dirty = set()
+        self.changes = []
+        self.recording = True
 
 
     def load(self, filename):
         """ Load the contents of qsl_info from a file.
-        The file should be a JSON serialization of a qsl info dict, with
-        the set of qso dates serialized as list
+        The file is either a JSON serialization of a qsl info dict, with
+        the qso dates serialized as list, or an sqlite database
         """
-        with open(filename, 'r', encoding='utf-8') as f:
-            self.qsl_info = json.load(f, object_hook = decode_set_hook(['qsos']))
+        with qslstore.lock(filename):
+            self.read_store(qslstore.open_store(filename))
+
 
-        # generate also a list of altrnate calls based on the existing data
-        # this is useful for adding qso-s at the correct location
+    def read_store(self, store):
+        """ Read the contents of qsl_info from a storage backend, the file
+        must be locked
+        """
+        self.store = store
+        self.qsl_info, changes = self.store.load()
+        self.version = self.store.version()
+        self.dirty = set()
+        self.changes = []
+
+        self.reset_indexes()
+        # received qsls were stored under a misspelled key by the earlier
+        # versions, these calls are saved again with the fixed key
+        fixed = set()
         for callsign, value in self.qsl_info.items():
-            # look only in lists
-            if type(value) is list:
-                for alternate in value:
-                    # look for non-obvious roamed call differences
-                    base_call = call.match(alternate['call']).group(1)
-                    if base_call != callsign:
-                        self.alternate_calls[base_call] = callsign
-            # if the callsign is a UK call, reduce it and add as alternate
-            alternate = reduce_UK_call(callsign)
-            if alternate != callsign:
-                self.alternate_calls[alternate] = callsign
+            if fix_received_key(value):
+                fixed.add(callsign)
+            self.index_key(callsign)
+        self.index_dates()
+
+        self.replay(changes)
+        # the replayed qsos are not new
+        self.stat_list = {}
+        self.dirty = fixed
+
+
+    def reset_indexes(self):
+        """ Clear the secondary indexes, maintained on every change of
+        qsl_info
+        """
+        self.alternate_calls = {}
+        # reduced UK call -> key
+        self.uk_keys = {}
+        # (key, roamed call) -> entry
+        self.roam_calls = {}
+        # dxcc entity -> [received, sent, all] number of calls
+        self.country_counts = {}
+        # country -> {call: number of entries} of the calls without qsl
+        self.no_qsl_calls = {}
+        # reverse indexes used by the queries, the values are the number of
+        # entries of each call
+        # dxcc entity -> {call: n}
+        self.country_calls = {}
+        # number of qsos -> {call: n}
+        self.count_calls = {}
+        # qsl status -> {(call, day ordinal of the last qso): n}
+        self.status_calls = {}
+        # day ordinal -> {callsign: n}, built when loaded and updated by
+        # add_qsos with the added dates (the other changes keep the dates)
+        self.date_calls = {}
+
+
+    def alternates(self, callsign, value):
+        """ Generate the alternate calls of a callsign based on the stored
+        data, this is useful for adding qso-s at the correct location
+        """
+        # look only in lists
+        if type(value) is list:
+            for alternate in value:
+                # look for non-obvious roamed call differences
+                base_call = call.match(alternate['call']).group(1)
+                if base_call != callsign:
+                    yield base_call
+        # if the callsign is a UK call, reduce it and add as alternate
+        alternate = reduce_UK_call(callsign)
+        if alternate != callsign:
+            yield alternate
+
+
+    def index_key(self, key):
+        """ Add a callsign of qsl_info to the secondary indexes
+        Must be called after the information of the callsign is changed
+        """
+        value = self.qsl_info.get(key)
+        if value is None:
+            return
+        self.uk_keys[reduce_UK_call(key)] = key
+        for entry in value if type(value) is list else [value]:
+            self.roam_calls.setdefault((key, entry['call']), entry)
+            self.count_entry(entry, 1)
+        for alternate in self.alternates(key, value):
+            self.alternate_calls[alternate] = key
+
+
+    def unindex_key(self, key):
+        """ Remove a callsign of qsl_info from the secondary indexes
+        Must be called before the information of the callsign is changed
+        """
+        value = self.qsl_info.get(key)
+        if value is None:
+            return
+        reduced = reduce_UK_call(key)
+        if self.uk_keys.get(reduced) == key:
+            del self.uk_keys[reduced]
+        for entry in value if type(value) is list else [value]:
+            self.roam_calls.pop((key, entry['call']), None)
+            self.count_entry(entry, -1)
+        for alternate in self.alternates(key, value):
+            if self.alternate_calls.get(alternate) == key:
+                del self.alternate_calls[alternate]
 
 
     def save(self, filename):
         """ Save the contents of qsl_info into a file.
-        The qsl information is serialized into a JSON format with the qso sets
-        implemented as lists
+        If the file is the one loaded, only the changed callsigns are
+        saved (if the backend supports it). If an other file was loaded, the
+        whole information is written and the file is used for the later saves.
+        The file is locked while saved. If it was changed by an other process
+        since it was read, the latest stored information is read and the
+        changes of this object are replayed on it before saving, so no
+        update is lost
+        """
+        with qslstore.lock(filename):
+            if self.store and self.store.filename == filename:
+                if self.store.version() != self.version:
+                    self.merge_stored(self.store)
+                self.store.save(self.qsl_info, self.dirty, self.changes)
+            elif self.store is None and os.path.exists(filename):
+                # nothing was loaded, but the file was created since
+                self.merge_stored(qslstore.open_store(filename))
+                self.store.save(self.qsl_info, self.dirty, self.changes)
+            else:
+                self.store = qslstore.open_store(filename)
+                self.store.save(self.qsl_info)
+            self.version = self.store.version()
+        self.dirty = set()
+        self.changes = []
+
+
+    def merge_stored(self, store):
+        """ Read the latest stored information and replay the changes of
+        this object on it
+        The qsos added in this run are kept for the statistics
         """
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(self.qsl_info, f, ensure_ascii=False, sort_keys=True,
-                      indent=4,
-                      default=encode_set_as_list)
+        changes = self.changes
+        stat_list = self.stat_list
+        self.read_store(store)
+        self.replay(changes)
+        self.changes = changes
+        self.stat_list = stat_list
+
+
+    def record(self, op, *args):
+        """ Record a changing operation for the journal
+        """
+        if self.recording:
+            self.changes.append((op, args))
+
+
+    def replay(self, changes):
+        """ Apply a list of recorded operations
+        The operations are not recorded again
+        """
+        recording = self.recording
+        self.recording = False
+        try:
+            for op, args in changes:
+                if op == 'add_qsos':
+                    date_str, qsos, countries = args
+                    self.add_qsos([JournalQSO(*q) for q in qsos],
+                                  datetime.date.fromisoformat(date_str), countries)
+                elif op in journal_ops:
+                    getattr(self, op)(*args)
+                else:
+                    raise ValueError("Invalid journal operation `{}`".format(op))
+        finally:
+            self.recording = recording
+
+
+    def export(self, filename):
+        """ Save the whole qsl information into another file, the format is
+        selected by the file name
+        """
+        qslstore.open_store(filename).save(self.qsl_info)
 
 
     def calls(self):
@@ -134,39 +320,132 @@ class QSL:
                 yield value
 
 
+    def count_entry(self, entry, n):
+        """ Add (n = 1) or remove (n = -1) a call entry from the country
+        qsl counters and the reverse indexes
+        The qso dates are not walked, only the last date of each call, the
+        date index is updated by add_qsos with the added dates
+        """
+        cty = country.fix4dxcc(entry['country'])
+        counts = self.country_counts.setdefault(cty, [0, 0, 0])
+        counts[0] += n if entry.get('qsl_received') else 0
+        counts[1] += n if entry.get('qsl_sent') else 0
+        counts[2] += n
+        if not counts[2]:
+            del self.country_counts[cty]
+        if not ('qsl_received' in entry or 'qsl_sent' in entry or 'noqsl' in entry):
+            count_item(self.no_qsl_calls, entry['country'], entry['call'], n)
+
+        count_item(self.country_calls, cty, entry['call'], n)
+        number = sum(len(dates) for dates in entry.get('qsos', {}).values())
+        count_item(self.count_calls, number, entry['call'], n)
+        count_item(self.status_calls, *self.entry_status(entry), n)
+
+
+    def entry_status(self, entry):
+        """ Return the qsl status of a call entry and the key of the entry
+        in the status index: the call and the day ordinal of its last qso
+        """
+        last = max((dates[-1] for dates in entry.get('qsos', {}).values() if dates), default=0)
+        if entry.get('qsl_received'):
+            status = 'received'
+        elif entry.get('qsl_sent'):
+            status = 'sent'
+        elif entry.get('noqsl'):
+            status = 'noqsl'
+        else:
+            status = None
+        return status, (entry['call'], last)
+
+
+    def index_dates(self):
+        """ Build the reverse index of the qso dates of all the calls
+        """
+        date_calls = {}
+        for entry in self.calls():
+            for callsign, dates in entry.get('qsos', {}).items():
+                for day in dates:
+                    calls = date_calls.get(day)
+                    if calls is None:
+                        date_calls[day] = {callsign: 1}
+                    else:
+                        calls[callsign] = calls.get(callsign, 0) + 1
+        self.date_calls = date_calls
+
+
+    def worked_on(self, date):
+        """ Return the callsigns worked on the given date
+        """
+        return sorted(self.date_calls.get(date.toordinal(), ()))
+
+
+    def entity_calls(self, cty):
+        """ Return the calls worked in the given dxcc entity
+        """
+        return sorted(self.country_calls.get(country.fix4dxcc(cty), ()))
+
+
+    def worked_more_than(self, count):
+        """ Return the calls with more than count qsos
+        """
+        return sorted(c for number, calls in self.count_calls.items()
+                      if number > count for c in calls)
+
+
+    def unanswered(self, days, today=None):
+        """ Return the calls whose qsl was sent but not received, with the
+        last qso older than the given number of days
+        """
+        today = today or datetime.date.today()
+        limit = today.toordinal() - days
+        return sorted({c for c, last in self.status_calls.get('sent', ()) if last < limit})
+
+
     def update_countries(self):
         """ Update the qsl info by country based on the current qsl status
         of the stored callsigns
+        The status is built from the counters, which are updated with every
+        change of the stored callsigns
         """
-        for call_info in self.calls():
-            cty = country.fix4dxcc(call_info['country'])
-            if call_info.get('qsl_received') or self.countries.get(cty) == 'confirmed':
+        self.countries = {}
+        for cty, (received, sent, _) in self.country_counts.items():
+            if received:
                 status = 'confirmed'
-            elif call_info.get('qsl_sent') or self.countries.get(cty) == 'unconfirmed':
+            elif sent:
                 status = 'unconfirmed'
             else:
                 status = None
             self.countries[cty] = status
 
 
-    def add_qsos(self, qsos, qso_date):
+    def add_qsos(self, qsos, qso_date, countries=None):
         """ Add a list of new qsos to the QSL info list
         All newly added qso is specially marked for later statistics.
         If the qso with the given date already existed in the qslinfo,
         the given date is treated as newly added for statistics purposes,
         so a log can be analyzed multiple times
+        The countries of the roamed calls can be given if already known
         """
 
         date_str = qso_date.strftime('%Y-%m-%d')
+        day = qso_date.toordinal()
         qso_time = (0,0)
-        for qso in qsos:
+        # resolve the countries of all roamed calls in one pass
+        matches = [call.match(qso.callsign) for qso in qsos]
+        roam_calls = [qso.callsign[:m.end(1)] for qso, m in zip(qsos, matches)]
+        if countries is None:
+            countries = {c: cty[0] for c, cty in country.find_many(roam_calls).items()}
+        self.record('add_qsos', date_str,
+                    [(qso.callsign, qso.time, getattr(qso, 'qsl_sent', None),
+                      getattr(qso, 'qsl_rcvd', None)) for qso in qsos],
+                    countries)
+        for qso, base_call, roam_call in zip(qsos, matches, roam_calls):
             if qso.time[0] < qso_time[0] or (qso.time[0] == qso_time[0] and qso.time[1] < qso_time[1]):
                 qso_date += datetime.timedelta(days=1)
                 date_str = qso_date.strftime('%Y-%m-%d')
+                day = qso_date.toordinal()
             qso_time = qso.time
 
-            base_call = call.match(qso.callsign)
-            roam_call = qso.callsign[:base_call.end(1)]
             base_call = base_call.group(1)
             # make sure this is not a known alternate call
             normalized_call = reduce_UK_call(base_call)
@@ -175,48 +454,55 @@ class QSL:
             elif normalized_call != base_call and normalized_call in self.qsl_info:
                 base_call = normalized_call
 
+            roamed = self.roam_calls.get((base_call, roam_call))
+            self.unindex_key(base_call)
             if base_call in self.qsl_info:
                 this_call = self.qsl_info[base_call]
-                if type(this_call) is list:
-                    call_list = [x for x in this_call if x.get('call') == roam_call]
-                    if not call_list:
-                        this_call = {
-                            'call': roam_call,
-                            'country': country.find(roam_call)[0]
-                        }
-                        self.qsl_info[base_call].append(this_call)
-                    else:
-                        this_call = call_list[0]
+                if roamed:
+                    this_call = roamed
+                elif type(this_call) is list:
+                    this_call = {
+                        'call': roam_call,
+                        'country': countries[roam_call]
+                    }
+                    self.qsl_info[base_call].append(this_call)
                 else:
                     if this_call.get('call') != roam_call:
                         this_call = {
                             'call': roam_call,
-                            'country': country.find(roam_call)[0]
+                            'country': countries[roam_call]
                         }
                         self.qsl_info[base_call] = [self.qsl_info[base_call], this_call]
             else:
                 this_call = {
                     'call': roam_call,
-                    'country': country.find(roam_call)[0]
+                    'country': countries[roam_call]
                 }
                 self.qsl_info[base_call] = this_call
+            self.dirty.add(base_call)
 
-            # add the qso date to this call
+            # add the qso date to this call, the dates are kept as a sorted
+            # array of day ordinals
             if 'qsos' not in this_call:
                 this_call['qsos'] = {}
             if qso.callsign not in this_call['qsos']:
-                this_call['qsos'][qso.callsign] = set()
+                this_call['qsos'][qso.callsign] = qslstore.date_array()
 
-            this_call['qsos'][qso.callsign].add(date_str)
+            dates = this_call['qsos'][qso.callsign]
+            i = bisect.bisect_left(dates, day)
+            if i == len(dates) or dates[i] != day:
+                dates.insert(i, day)
+                count_item(self.date_calls, day, qso.callsign, 1)
 
             rec = getattr(qso, 'qsl_rcvd', None)
             sen = getattr(qso, 'qsl_sent', None)
 
             translate_qso_qsl = {'$': 'direct$', '%': 'direct', '@': 'bureau'}
             if rec in translate_qso_qsl:
-                qsl_ranking(this_call, 'qsl_reveived', translate_qso_qsl[rec])
+                qsl_ranking(this_call, 'qsl_received', translate_qso_qsl[rec])
             if sen in translate_qso_qsl:
                 qsl_ranking(this_call, 'qsl_sent', translate_qso_qsl[sen])
+            self.index_key(base_call)
 
             # add the qso date to the new call list, for statistical purposes
             self.stat_list[base_call] = (this_call, date_str)
@@ -247,15 +533,24 @@ class QSL:
         m = call.fullmatch(callsign)
         if not m:
             raise ValueError("Invalid callsign: {}".format(callsign))
-        call_info = self.qsl_info.get(m.group(1).upper())
+        key = m.group(1).upper()
+        call_info = self.qsl_info.get(key)
+        # recorded even if the call is not known yet, it may be known when
+        # replayed on the information saved by an other process
+        self.record('set_no_qsl', callsign)
+        if call_info:
+            self.dirty.add(key)
+            self.unindex_key(key)
         if type(call_info) is list:
             for c in call_info:
                 c['noqsl'] = True
         elif type(call_info) is dict:
             call_info['noqsl'] = True
+        self.index_key(key)
 
 
     def set_qsl_sent_rcvd(self, callsign, sent=True):
+        marked = callsign
         if callsign.endswith('$'):
             v = 'direct$'
             callsign = callsign[:-1]
@@ -267,25 +562,98 @@ class QSL:
         m = call.fullmatch(callsign)
         if not m:
             raise ValueError("Invalid callsign: {}".format(callsign))
-        call_info = self.qsl_info.get(m.group(1).upper())
+        key = m.group(1).upper()
+        call_info = self.qsl_info.get(key)
+        # recorded even if the call is not known yet, it may be known when
+        # replayed on the information saved by an other process
+        self.record('set_qsl_sent_rcvd', marked, sent)
+        if call_info:
+            self.dirty.add(key)
+            self.unindex_key(key)
         if type(call_info) is list:
             for c in call_info:
                 if c['call'] == callsign[:m.end(1)].upper():
                     qsl_ranking(c, 'qsl_sent' if sent else 'qsl_received', v)
         elif type(call_info) is dict:
             qsl_ranking(call_info, 'qsl_sent' if sent else 'qsl_received', v)
+        self.index_key(key)
+
+
+    def mark_received(self, key, roam_call, qsl='electronic'):
+        """ Mark the qsl of a roamed variant of a stored call as received
+        """
+        self.record('mark_received', key, roam_call, qsl)
+        entry = self.roam_calls.get((key, roam_call))
+        if entry:
+            self.unindex_key(key)
+            qsl_ranking(entry, 'qsl_received', qsl)
+            self.index_key(key)
+            self.dirty.add(key)
+
+
+    def confirm_qsos(self, records, qsl='electronic'):
+        """ Mark the qsos confirmed by a list of ADIF records (e.g. read
+        from a LoTW or eQSL export) as received
+        The records are matched with a hash join: a hash table of the
+        stored qsos by the logged callsign and by the roamed call is built
+        in one pass over the qsl info, then each record is looked up by its
+        callsign and the qso date is searched in the dates of the call.
+        The band of the qsos is not stored, so it is not matched.
+        Records with the qsl received field set to other than yes are
+        skipped.
+        Return the number of matched records and the list of the unmatched
+        ones
+        """
+        calls = {}
+        roamed = {}
+        for key, value in self.qsl_info.items():
+            for entry in value if type(value) is list else [value]:
+                for callsign, dates in entry.get('qsos', {}).items():
+                    calls.setdefault(callsign, []).append((key, entry, dates))
+                    roamed.setdefault(entry['call'], []).append((key, entry, dates))
+
+        matched = 0
+        unmatched = []
+        confirmed = set()
+        for record in records:
+            if record.get('QSL_RCVD', 'Y').upper() not in ('Y', 'V'):
+                continue
+            callsign = record.get('CALL', '').upper()
+            date = adif.record_date(record)
+            found = None
+            if date:
+                day = date.toordinal()
+                candidates = calls.get(callsign)
+                if not candidates:
+                    m = call.fullmatch(callsign)
+                    candidates = roamed.get(callsign[:m.end(1)], ()) if m else ()
+                for key, entry, dates in candidates:
+                    i = bisect.bisect_left(dates, day)
+                    if i < len(dates) and dates[i] == day:
+                        found = (key, entry['call'])
+                        break
+            if found:
+                matched += 1
+                confirmed.add(found)
+            else:
+                unmatched.append(record)
+
+        for key, roam_call in sorted(confirmed):
+            self.mark_received(key, roam_call, qsl)
+        return matched, unmatched
 
 
     def change_uk_key(self, key):
         if key[0] not in 'GM2':
             return False
-        basekey = reduce_UK_call(key)
-        oldkey = ''
-        for k in self.qsl_info.keys():
-            if reduce_UK_call(k) == basekey:
-                oldkey = k
+        oldkey = self.uk_keys.get(reduce_UK_call(key))
         if oldkey and oldkey != key:
+            self.unindex_key(oldkey)
+            self.unindex_key(key)
             self.qsl_info[key] = self.qsl_info.pop(oldkey)
+            self.index_key(key)
+            self.dirty.update((key, oldkey))
+            self.record('change_uk_key', key)
             return True
         return False
 
@@ -315,17 +683,28 @@ class QSL:
                 keys.append(k)
         if len(keys) == 1:
             if keys[0] != callsign:
+                self.unindex_key(keys[0])
+                self.unindex_key(callsign)
                 self.qsl_info[callsign] = self.qsl_info.pop(keys[0])
+                self.index_key(callsign)
+                self.dirty.update((callsign, keys[0]))
+                self.record('merge_calls', calls, default)
                 return True
         elif len(keys) > 1:
             qsl = []
             for k in keys:
+                self.unindex_key(k)
                 old_qsl = self.qsl_info.pop(k)
                 if type(old_qsl) is list:
                     qsl.extend(old_qsl)
                 else:
                     qsl.append(old_qsl)
+            self.unindex_key(callsign)
             self.qsl_info[callsign] = qsl
+            self.index_key(callsign)
+            self.dirty.update(keys)
+            self.dirty.add(callsign)
+            self.record('merge_calls', calls, default)
             return True
         return False
 
@@ -348,17 +727,38 @@ if __name__ == '__main__':
                         help='Set default UK callsign')
     parser.add_argument('-m', '--merge', nargs='+',
                         help='Merge multiple alternate callsigns')
+    parser.add_argument('--cty',
+                        help='Country database file (cty.dat). If ommited `cty.dat` from the current directory is used')
+    parser.add_argument('--worked', metavar='DATE', type=datetime.date.fromisoformat,
+                        help='List the callsigns worked on the given date (YYYY-MM-DD)')
+    parser.add_argument('--entity', metavar='CTY',
+                        help='List the calls worked in the given DXCC entity')
+    parser.add_argument('--more-than', metavar='N', type=int,
+                        help='List the calls worked more than N times')
+    parser.add_argument('--unanswered', metavar='DAYS', type=int,
+                        help='List the calls with qsl sent but not received, last worked more than DAYS days ago')
+    parser.add_argument('--confirm', metavar='FILE',
+                        help='Mark the qsos confirmed in the given ADIF file (e.g. LoTW or eQSL export) as received')
+    parser.add_argument('--import', dest='import_file', metavar='FILE',
+                        help='Replace the qsl information with the one from the given file (JSON or sqlite database)')
+    parser.add_argument('--export', metavar='FILE',
+                        help='Save the qsl information into the given file (JSON or sqlite database, based on the extension)')
     args = parser.parse_args()
 
-    qsl_info = QSL()
+    if args.cty:
+        country.set_database(args.cty)
 
-    if args.file:
-        qsl_info.load(args.file)
-    else:
-        qsl_info.load('qsl.lst')
+    qsl_info = QSL()
+    filename = args.file if args.file else 'qsl.lst'
 
     dirty = False
 
+    if args.import_file:
+        qsl_info.load(args.import_file)
+        dirty = True
+    else:
+        qsl_info.load(filename)
+
     if args.blacklist:
         print('Enter "no-qsl" callsigns (followed by CTRL-D):')
         lines = sys.stdin.readlines()
@@ -397,6 +797,16 @@ if __name__ == '__main__':
         if qsl_info.merge_calls(args.merge):
             dirty = True
 
+    if args.confirm:
+        with open(args.confirm, 'r', encoding='utf-8', errors='replace') as f:
+            matched, unmatched = qsl_info.confirm_qsos(adif.read_records(f))
+        print('Confirmed qsos: {}'.format(matched))
+        print('Unmatched confirmations: {}'.format(len(unmatched)))
+        for r in unmatched:
+            print('  {} {} {}'.format(r.get('CALL', '-'), r.get('QSO_DATE', '-'), r.get('BAND', '-')))
+        if matched:
+            dirty = True
+
     if args.countries:
         qsl_info.update_countries()
         confirmed = [x for x in qsl_info.countries.keys() if qsl_info.countries[x] == 'confirmed']
@@ -406,24 +816,36 @@ if __name__ == '__main__':
         new = [x for x in qsl_info.countries.keys() if not qsl_info.countries[x]]
         print('New countries: {}\n{}'.format(len(new), ' '.join(sorted(new))))
 
-        lc = {}
-        for i in qsl_info.calls():
-            if ((i['country'] in unconfirmed or i['country'] in new) and
-                ('qsl_recived' not in i and 'qsl_sent' not in i and 'noqsl' not in i)):
-                if i['country'] not in lc:
-                    lc[i['country']] = []
-                lc[i['country']].append(i['call'])
+        lc = {cty: calls for cty, calls in qsl_info.no_qsl_calls.items()
+              if cty in unconfirmed or cty in new}
 
         for cty in sorted(lc.keys()):
             print('{} {}: {}'.format(cty, country.country_name(cty), qsl_info.countries[cty] if qsl_info.countries.get(cty) else 'new!'))
             for c in sorted(lc[cty]):
-                print('  {}'.format(c))
+                for i in range(lc[cty][c]):
+                    print('  {}'.format(c))
+
 
 
+    if args.worked:
+        for c in qsl_info.worked_on(args.worked):
+            print(c)
+
+    if args.entity:
+        for c in qsl_info.entity_calls(args.entity.upper()):
+            print(c)
+
+    if args.more_than is not None:
+        for c in qsl_info.worked_more_than(args.more_than):
+            print(c)
+
+    if args.unanswered is not None:
+        for c in qsl_info.unanswered(args.unanswered):
+            print(c)
 
     if dirty:
-        if args.file:
-            qsl_info.save(args.file)
-        else:
-            qsl_info.save('qsl.lst')
+        qsl_info.save(filename)
+
+    if args.export:
+        qsl_info.export(args.export)
 
@@ -0,0 +1,326 @@
+""" Storage backends of the qsl information
+The qsl information (see qslinfo.QSL) is a dictionary of the contacted
+base callsigns, each holding either a dict or a list of dicts (one for each
+roamed variant of the call). The backends load this dictionary and save it
+back, either completely or only the changed callsigns.
+
+JSONStore keeps the information in a single JSON file (the original
+`qsl.lst` format) and an append-only journal of the changing operations
+next to it, SQLiteStore keeps it in an sqlite database with indexed
+tables for the calls, roamed variants, qso dates and qsl status, so only the
+changed calls are written in a transaction.
+
+The qso dates of a callsign are kept as a sorted array of day ordinals
+(datetime.date.toordinal) both in memory and in the files. Dates stored as
+'%Y-%m-%d' strings by the earlier versions are converted when loaded.
+"""
+
+import os
+import json
+import sqlite3
+import array
+import datetime
+import operator
+import itertools
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    # no fcntl on Windows
+    fcntl = None
+    import msvcrt
+
+
+# file extensions handled by the sqlite backend
+sqlite_ext = ('.db', '.sqlite', '.sqlite3')
+
+journal_suffix = '.journal'
+lock_suffix = '.lock'
+# size of the journal (in bytes) above which a new snapshot is written
+journal_limit = 1 << 18
+
+
+@contextlib.contextmanager
+def lock(filename):
+    """ Hold an exclusive lock of the qsl information file, used while the
+    file is read or written. The lock is taken on a separate lock file, so
+    the data files can be replaced while locked.
+    The lock is not reentrant.
+    """
+    with open(filename + lock_suffix, 'a') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def file_version(filename):
+    """ Return the size and modification time of a file, None if the file
+    does not exist
+    """
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def day_ordinal(value):
+    """ Convert a stored qso date (day ordinal or '%Y-%m-%d' string) to
+    a day ordinal
+    """
+    if type(value) is int:
+        return value
+    if value.isdigit():
+        return int(value)
+    return datetime.date.fromisoformat(value).toordinal()
+
+
+def date_array(values=()):
+    """ Return the sorted array of the day ordinals of the qso dates
+    """
+    try:
+        # the saved lists are already sorted day ordinals
+        dates = array.array('I', values)
+        if all(a < b for a, b in zip(dates, dates[1:])):
+            return dates
+    except TypeError:
+        pass
+    return array.array('I', sorted({day_ordinal(v) for v in values}))
+
+
+def decode_dates_hook(obj):
+    """ Decode the qso date lists of the JSON call entries into arrays
+    """
+    qsos = obj.get('qsos')
+    if type(qsos) is dict:
+        for k, v in qsos.items():
+            qsos[k] = date_array(v)
+    return obj
+
+
+def encode_dates(obj):
+    if type(obj) is array.array:
+        return obj.tolist()
+    if type(obj) is set:
+        return sorted(day_ordinal(v) for v in obj)
+    raise TypeError
+
+
+class JSONStore:
+    """ QSL information stored as a JSON file
+    The file is a snapshot of the information, the operations changing it
+    are appended to a journal (one JSON line per operation), which is
+    replayed after the snapshot is loaded. When the journal grows over the
+    limit, a new snapshot is written and the journal is removed.
+    The snapshot is replaced atomically, and the operations are idempotent,
+    so a journal left after a crash can be replayed on the new snapshot.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.journal = filename + journal_suffix
+
+
+    def load(self):
+        """ Return the qsl information of the snapshot and the list of
+        operations of the journal (partially written lines are ignored)
+        """
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            qsl_info = json.load(f, object_hook = decode_dates_hook)
+        changes = []
+        try:
+            with open(self.journal, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        changes.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return qsl_info, changes
+
+
+    def version(self):
+        """ Return a value which changes when the snapshot or the journal is
+        written
+        """
+        return file_version(self.filename), file_version(self.journal)
+
+
+    def save(self, qsl_info, keys=None, changes=None):
+        """ Save the qsl information, keys is the set of changed callsigns
+        and changes the list of operations since the load (None if
+        everything changed), nothing is written if no call changed
+        """
+        if keys is not None and not keys:
+            return
+        if keys is not None and changes:
+            try:
+                size = os.path.getsize(self.journal)
+            except OSError:
+                size = 0
+            if size < journal_limit:
+                with open(self.journal, 'a', encoding='utf-8') as f:
+                    if size:
+                        # terminate a line left partially written
+                        with open(self.journal, 'rb') as j:
+                            j.seek(-1, os.SEEK_END)
+                            if j.read(1) != b'\n':
+                                f.write('\n')
+                    for change in changes:
+                        f.write(json.dumps(change, ensure_ascii=False) + '\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                return
+        self.write_snapshot(qsl_info)
+
+
+    def write_snapshot(self, qsl_info):
+        """ Write the whole qsl information into a new snapshot, which
+        replaces the old one, then remove the journal
+        """
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(qsl_info, f, ensure_ascii=False, sort_keys=True,
+                      indent=4,
+                      default=encode_dates)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+        try:
+            os.remove(self.journal)
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteStore:
+    """ QSL information stored in an sqlite database
+    Each variant of a callsign is a row of the calls table, the dict based
+    entries have the index -1, the entries of a list are numbered from 0.
+    The qso dates are rows of the qsos table, as day ordinals. Fields not
+    having a column are kept as JSON in the extra column.
+    Only the changed calls are written, but the whole database is still
+    loaded into memory: the indexes of the calls and the qso dates are not
+    used by the converters, they are only there for queries run on the
+    database directly.
+    """
+    schema = """
+        CREATE TABLE IF NOT EXISTS calls (
+            key TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            call TEXT NOT NULL,
+            country TEXT,
+            qsl_sent TEXT,
+            qsl_received TEXT,
+            noqsl INTEGER,
+            extra TEXT,
+            PRIMARY KEY (key, idx)
+        );
+        CREATE INDEX IF NOT EXISTS calls_call ON calls (call);
+        CREATE INDEX IF NOT EXISTS calls_country ON calls (country);
+        CREATE INDEX IF NOT EXISTS calls_status ON calls (qsl_received, qsl_sent);
+        CREATE TABLE IF NOT EXISTS qsos (
+            key TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            callsign TEXT NOT NULL,
+            date INTEGER NOT NULL,
+            PRIMARY KEY (key, idx, callsign, date)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS qsos_date ON qsos (date);
+    """
+    columns = ('call', 'country', 'qsl_sent', 'qsl_received', 'noqsl')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(self.schema)
+
+
+    def load(self):
+        qsl_info = {}
+        entries = {}
+        for row in self.db.execute("SELECT key, idx, call, country, qsl_sent, "
+                                   "qsl_received, noqsl, extra FROM calls ORDER BY key, idx"):
+            key, idx = row[:2]
+            entry = json.loads(row[7]) if row[7] else {}
+            for k, v in zip(self.columns, row[2:7]):
+                if v is not None:
+                    entry[k] = bool(v) if k == 'noqsl' else v
+            entries[key, idx] = entry
+            if idx < 0:
+                qsl_info[key] = entry
+            else:
+                qsl_info.setdefault(key, []).append(entry)
+        # the rows are read in the order of the primary key, so the dates
+        # of a call come sorted and grouped together
+        rows = self.db.execute("SELECT key, idx, callsign, date FROM qsos "
+                               "ORDER BY key, idx, callsign, date")
+        for (key, idx, callsign), group in itertools.groupby(rows, operator.itemgetter(0, 1, 2)):
+            entries[key, idx].setdefault('qsos', {})[callsign] = array.array('I', [r[3] for r in group])
+        return qsl_info, []
+
+
+    def version(self):
+        """ Return a value which changes when an other connection commits
+        changes into the database
+        """
+        return self.db.execute("PRAGMA data_version").fetchone()[0]
+
+
+    def rows(self, key, value):
+        """ Generate the rows of the calls and qsos tables of a callsign
+        """
+        values = list(enumerate(value)) if type(value) is list else [(-1, value)]
+        for idx, entry in values:
+            extra = {k: v for k,v in entry.items() if k not in self.columns and k != 'qsos'}
+            noqsl = entry.get('noqsl')
+            yield 'calls', (key, idx, entry['call'], entry.get('country'),
+                            entry.get('qsl_sent'), entry.get('qsl_received'),
+                            None if noqsl is None else int(noqsl),
+                            json.dumps(extra, sort_keys=True) if extra else None)
+            for callsign, dates in entry.get('qsos', {}).items():
+                for date in dates:
+                    yield 'qsos', (key, idx, callsign, date)
+
+
+    def save(self, qsl_info, keys=None, changes=None):
+        """ Save the qsl information, keys is the set of changed callsigns
+        (None if everything changed). Removed callsigns are deleted.
+        The changed rows are written directly, the list of operations is not
+        needed
+        """
+        with self.db:
+            if keys is None:
+                self.db.execute("DELETE FROM calls")
+                self.db.execute("DELETE FROM qsos")
+                keys = qsl_info.keys()
+            else:
+                for key in keys:
+                    self.db.execute("DELETE FROM calls WHERE key = ?", (key,))
+                    self.db.execute("DELETE FROM qsos WHERE key = ?", (key,))
+            calls = []
+            qsos = []
+            for key in keys:
+                if key in qsl_info:
+                    for table, row in self.rows(key, qsl_info[key]):
+                        (calls if table == 'calls' else qsos).append(row)
+            self.db.executemany("INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?)", calls)
+            self.db.executemany("INSERT INTO qsos VALUES (?, ?, ?, ?)", qsos)
+
+
+def open_store(filename):
+    """ Return the storage backend of the file, selected by the extension
+    """
+    if os.path.splitext(filename)[1].lower() in sqlite_ext:
+        return SQLiteStore(filename)
+    return JSONStore(filename)
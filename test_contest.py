@@ -0,0 +1,98 @@
+""" Tests of the contest engine
+"""
+
+import datetime
+import types
+
+import contest
+
+
+# countries given to the contest directly, the country database is not used
+eu = {'continent': 'EU', 'cq': 14, 'itu': 28}
+na = {'continent': 'NA', 'cq': 5, 'itu': 8}
+countries = {
+    'DL1ABC': ('DL', eu),
+    'G4XYZ': ('G', eu),
+    'W1AW': ('K', na),
+    'HA5XYZ/P': ('HA', eu),
+}
+
+
+def qso(callsign, freq='14.062', mode='CW', time=(12, 0)):
+    return types.SimpleNamespace(callsign=callsign, freq=freq, mode=mode, time=time,
+                                 sent='599', rcvd='599', exch='001')
+
+
+def fd_contest():
+    c = contest.Contest('fd')
+    c.own = ('YO', eu)
+    return c
+
+
+def add(c, q):
+    return c.add_qso('YO6PIB/P', datetime.date(2020, 6, 1), q, countries[q.callsign])
+
+
+def test_dupe_same_band_and_mode():
+    c = fd_contest()
+    first = add(c, qso('DL1ABC'))
+    assert c.worked_before('DL1ABC', '14.062', 'CW') == first
+    assert c.is_dupe('dl1abc', '14.070', 'cw')
+    add(c, qso('DL1ABC', time=(12, 5)))
+    summary = c.score_summary()
+    assert summary['qsos'] == 2
+    assert summary['dupes'] == 1
+    assert summary['points'] == 2
+
+
+def test_other_band_or_mode_is_not_dupe():
+    c = fd_contest()
+    add(c, qso('DL1ABC'))
+    assert not c.is_dupe('DL1ABC', '7.030', 'CW')
+    assert not c.is_dupe('DL1ABC', '14.200', 'SSB')
+    add(c, qso('DL1ABC', freq='7.030'))
+    add(c, qso('DL1ABC', freq='14.200', mode='SSB'))
+    assert c.score_summary()['dupes'] == 0
+    assert c.score_summary()['points'] == 6
+
+
+def test_score_totals():
+    c = fd_contest()
+    add(c, qso('DL1ABC'))
+    add(c, qso('W1AW'))
+    add(c, qso('G4XYZ', freq='7.030'))
+    summary = c.score_summary()
+    # 2 points for fixed stations, doubled outside of the own continent
+    assert summary['points'] == 2 + 4 + 2
+    # multipliers: countries on each band
+    assert summary['mult'] == 3
+    assert summary['score'] == 8 * 3
+
+
+def test_portable_station():
+    c = fd_contest()
+    add(c, qso('HA5XYZ/P'))
+    assert c.score_summary()['points'] == 3
+
+
+def test_removed_first_qso_scores_the_dupe():
+    c = fd_contest()
+    first = add(c, qso('DL1ABC'))
+    dupe = add(c, qso('DL1ABC', time=(12, 5)))
+    c.remove_qso(first)
+    assert c.worked_before('DL1ABC', '14.062', 'CW') == dupe
+    summary = c.score_summary()
+    assert summary['qsos'] == 1
+    assert summary['dupes'] == 0
+    assert summary['points'] == 2
+
+
+def test_removed_dupe():
+    c = fd_contest()
+    add(c, qso('DL1ABC'))
+    dupe = add(c, qso('DL1ABC', time=(12, 5)))
+    c.remove_qso(dupe)
+    summary = c.score_summary()
+    assert summary['qsos'] == 1
+    assert summary['dupes'] == 0
+    assert summary['points'] == 2
@@ -0,0 +1,79 @@
+""" Tests of the cross-check of contest logs
+"""
+
+import io
+
+import crosscheck
+
+
+def cabrillo_log(callsign, *qsos):
+    return io.StringIO("START-OF-LOG: 3.0\nCALLSIGN: {}\n{}END-OF-LOG:\n".format(
+        callsign, ''.join("QSO: {}\n".format(q) for q in qsos)))
+
+
+def check_logs(*logs):
+    check = crosscheck.CrossCheck()
+    for log in logs:
+        check.read(log)
+    check.check()
+    return {log.callsign: [q.status + ''.join(q.problems) for q in log.qsos]
+            for log in check.logs}
+
+
+def test_matching_qsos():
+    result = check_logs(
+        cabrillo_log('YO6PIB', '14062 CW 2020-06-01 1200 YO6PIB 599 001 DL1ABC 599 005'),
+        cabrillo_log('DL1ABC', '14062 CW 2020-06-01 1201 DL1ABC 599 005 YO6PIB 599 001'))
+    assert result == {'YO6PIB': ['ok'], 'DL1ABC': ['ok']}
+
+
+def test_busted_call_penalizes_only_the_busting_station():
+    # YO6PIB copied DL1ABC as DL1ABD, DL1ABC logged the contact correctly
+    result = check_logs(
+        cabrillo_log('YO6PIB', '14062 CW 2020-06-01 1205 YO6PIB 599 002 DL1ABD 599 006'),
+        cabrillo_log('DL1ABC', '14062 CW 2020-06-01 1206 DL1ABC 599 006 YO6PIB 599 002'))
+    assert result == {'YO6PIB': ['B'], 'DL1ABC': ['ok']}
+
+
+def test_busted_call_detail():
+    check = crosscheck.CrossCheck()
+    check.read(cabrillo_log('YO6PIB', '14062 CW 2020-06-01 1205 YO6PIB 599 002 DL1ABD 599 006'))
+    check.read(cabrillo_log('DL1ABC', '14062 CW 2020-06-01 1206 DL1ABC 599 006 YO6PIB 599 002'))
+    check.check()
+    assert check.logs[0].qsos[0].detail == ['DL1ABC']
+
+
+def test_not_in_log():
+    result = check_logs(
+        cabrillo_log('YO6PIB', '14062 CW 2020-06-01 1200 YO6PIB 599 001 DL1ABC 599 005',
+                     '7030 CW 2020-06-01 1300 YO6PIB 599 002 DL1ABC 599 010'),
+        cabrillo_log('DL1ABC', '14062 CW 2020-06-01 1200 DL1ABC 599 005 YO6PIB 599 001'))
+    assert result == {'YO6PIB': ['ok', 'N'], 'DL1ABC': ['ok']}
+
+
+def test_unique_call():
+    result = check_logs(
+        cabrillo_log('YO6PIB', '7030 CW 2020-06-01 1215 YO6PIB 599 004 W1AW 599 001'))
+    assert result == {'YO6PIB': ['U']}
+
+
+def test_call_worked_by_several_logs_is_not_unique():
+    result = check_logs(
+        cabrillo_log('YO6PIB', '7030 CW 2020-06-01 1215 YO6PIB 599 001 W1AW 599 001'),
+        cabrillo_log('G4XYZ', '7030 CW 2020-06-01 1220 G4XYZ 599 001 W1AW 599 002'))
+    assert result == {'YO6PIB': ['ok'], 'G4XYZ': ['ok']}
+
+
+def test_exchange_and_time_mismatch():
+    # G4XYZ copied a wrong exchange and logged the contact 4 minutes later
+    result = check_logs(
+        cabrillo_log('YO6PIB', '14062 CW 2020-06-01 1210 YO6PIB 599 003 G4XYZ 599 010'),
+        cabrillo_log('G4XYZ', '14062 CW 2020-06-01 1214 G4XYZ 599 010 YO6PIB 599 004'))
+    assert result == {'YO6PIB': ['okT'], 'G4XYZ': ['okXT']}
+
+
+def test_contact_outside_of_the_window_is_not_matched():
+    result = check_logs(
+        cabrillo_log('YO6PIB', '14062 CW 2020-06-01 1200 YO6PIB 599 001 DL1ABC 599 005'),
+        cabrillo_log('DL1ABC', '14062 CW 2020-06-01 1230 DL1ABC 599 005 YO6PIB 599 001'))
+    assert result == {'YO6PIB': ['N'], 'DL1ABC': ['N']}
@@ -0,0 +1,139 @@
+""" Tests of the qsl information storage: journal replay and merging the
+concurrent updates on save
+"""
+
+import os
+import datetime
+
+import pytest
+
+import qslinfo
+
+
+# countries of the roamed calls given to add_qsos, the country database is
+# not used
+countries = {'DL1ABC': 'DL', 'G4XYZ': 'G', 'W1AW': 'K'}
+
+
+def add(qsl, date, *calls):
+    qsos = [qslinfo.JournalQSO(c, (12, i), None, None) for i, c in enumerate(calls)]
+    qsl.add_qsos(qsos, date, countries)
+
+
+def loaded(filename):
+    qsl = qslinfo.QSL()
+    qsl.load(filename)
+    return qsl
+
+
+@pytest.fixture
+def qsl_file(tmp_path):
+    filename = str(tmp_path / 'qsl.lst')
+    qsl = qslinfo.QSL()
+    add(qsl, datetime.date(2020, 6, 1), 'DL1ABC', 'G4XYZ')
+    qsl.save(filename)
+    return filename
+
+
+def test_changes_are_journaled(qsl_file):
+    qsl = loaded(qsl_file)
+    snapshot = os.path.getmtime(qsl_file), os.path.getsize(qsl_file)
+    qsl.set_qsl_sent_rcvd('DL1ABC')
+    add(qsl, datetime.date(2020, 6, 2), 'W1AW', 'DL1ABC')
+    qsl.save(qsl_file)
+    assert os.path.exists(qsl_file + qslinfo.qslstore.journal_suffix)
+    assert (os.path.getmtime(qsl_file), os.path.getsize(qsl_file)) == snapshot
+    assert loaded(qsl_file).qsl_info == qsl.qsl_info
+
+
+def test_journal_replay(qsl_file):
+    qsl = loaded(qsl_file)
+    qsl.set_no_qsl('G4XYZ')
+    qsl.set_qsl_sent_rcvd('DL1ABC*')
+    add(qsl, datetime.date(2020, 6, 2), 'DL1ABC')
+    qsl.save(qsl_file)
+
+    replayed = loaded(qsl_file)
+    assert replayed.qsl_info['G4XYZ']['noqsl'] is True
+    assert replayed.qsl_info['DL1ABC']['qsl_sent'] == 'direct'
+    assert list(replayed.qsl_info['DL1ABC']['qsos']['DL1ABC']) == [
+        datetime.date(2020, 6, 1).toordinal(), datetime.date(2020, 6, 2).toordinal()]
+    assert replayed.worked_on(datetime.date(2020, 6, 2)) == ['DL1ABC']
+    assert replayed.unanswered(0, datetime.date(2020, 6, 10)) == ['DL1ABC']
+
+
+def test_partial_journal_line_is_ignored(qsl_file):
+    qsl = loaded(qsl_file)
+    qsl.set_no_qsl('G4XYZ')
+    qsl.save(qsl_file)
+    # a crash while the journal was appended
+    with open(qsl_file + qslinfo.qslstore.journal_suffix, 'a', encoding='utf-8') as f:
+        f.write('["set_no_qsl", ["DL1')
+    qsl = loaded(qsl_file)
+    assert qsl.qsl_info['G4XYZ']['noqsl'] is True
+    assert 'noqsl' not in qsl.qsl_info['DL1ABC']
+
+    # the later appends are not lost
+    qsl.set_qsl_sent_rcvd('DL1ABC')
+    qsl.save(qsl_file)
+    qsl = loaded(qsl_file)
+    assert qsl.qsl_info['G4XYZ']['noqsl'] is True
+    assert qsl.qsl_info['DL1ABC']['qsl_sent'] == 'bureau'
+
+
+def test_snapshot_replaces_the_journal(qsl_file, monkeypatch):
+    monkeypatch.setattr(qslinfo.qslstore, 'journal_limit', 0)
+    qsl = loaded(qsl_file)
+    qsl.set_no_qsl('G4XYZ')
+    qsl.save(qsl_file)
+    assert not os.path.exists(qsl_file + qslinfo.qslstore.journal_suffix)
+    assert loaded(qsl_file).qsl_info['G4XYZ']['noqsl'] is True
+
+
+@pytest.fixture(params=['qsl.lst', 'qsl.db'])
+def stored(request, tmp_path):
+    filename = str(tmp_path / request.param)
+    qsl = qslinfo.QSL()
+    add(qsl, datetime.date(2020, 6, 1), 'DL1ABC', 'G4XYZ')
+    qsl.save(filename)
+    return filename
+
+
+def test_concurrent_updates_are_merged(stored):
+    first = loaded(stored)
+    second = loaded(stored)
+    first.set_no_qsl('G4XYZ')
+    add(first, datetime.date(2020, 6, 2), 'W1AW')
+    first.save(stored)
+    # the second process saves after the first one, without losing its changes
+    second.set_qsl_sent_rcvd('DL1ABC')
+    add(second, datetime.date(2020, 6, 3), 'W1AW')
+    second.save(stored)
+
+    merged = loaded(stored)
+    assert merged.qsl_info == second.qsl_info
+    assert merged.qsl_info['G4XYZ']['noqsl'] is True
+    assert merged.qsl_info['DL1ABC']['qsl_sent'] == 'bureau'
+    assert list(merged.qsl_info['W1AW']['qsos']['W1AW']) == [
+        datetime.date(2020, 6, 2).toordinal(), datetime.date(2020, 6, 3).toordinal()]
+    assert merged.worked_on(datetime.date(2020, 6, 3)) == ['W1AW']
+
+
+def test_change_of_unknown_call_is_merged(stored):
+    first = loaded(stored)
+    second = loaded(stored)
+    add(first, datetime.date(2020, 6, 2), 'W1AW')
+    first.save(stored)
+    # the call is not known to the second process yet
+    second.set_no_qsl('W1AW')
+    second.save(stored)
+    assert loaded(stored).qsl_info['W1AW']['noqsl'] is True
+
+
+def test_save_without_changes_keeps_the_stored_information(stored):
+    first = loaded(stored)
+    second = loaded(stored)
+    first.set_no_qsl('G4XYZ')
+    first.save(stored)
+    second.save(stored)
+    assert loaded(stored).qsl_info['G4XYZ']['noqsl'] is True